@@ -16,22 +16,80 @@
 ##   along with this program; if not, write to the Free Software
 ###  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #####
-import StringIO
-import mimetools
+from email.parser import HeaderParser
+import re
+import sys
+
+# the blank line between the headers and the body of a mail
+HEADER_END = re.compile(br'\r?\n\r?\n')
+# a blank line at the very start of a mail, which has no headers
+HEADERS_EMPTY = re.compile(br'\r?\n')
+
+
+def split_offsets(mailString, limit=sys.maxint):
+    """ returns the offset of the end of the headers, and the offset of
+        the start of the body, of a mail given as a string or a read-only
+        buffer (such as a memory-map)
+
+        Like mimetools, a mail that starts with a blank line has no
+        headers, and a mail without a blank line has no body: both
+        offsets are then the length of the mail. Only the first ``limit``
+        bytes are searched for the blank line; if it is not found there
+        both offsets are ``limit``.
+    """
+    m = (HEADERS_EMPTY.match(mailString)
+         or HEADER_END.search(mailString, 0, limit))
+    if m:
+        retval = (m.start(), m.end())
+    else:
+        end = min(len(mailString), limit)
+        retval = (end, end)
+    return retval
+
+
+def body_view(mailString, start):
+    """ returns a read-only view of the body of a mail, which shares the
+        memory of the mail rather than copying it
+    """
+    try:
+        retval = memoryview(mailString)[start:]
+    except TypeError:
+        # A memory-map lacks the new buffer interface
+        retval = buffer(mailString, start)
+    return retval
+
+
+def split_mail(mailString):
+    """ returns (headers, body) of a mail given as a string or a read-only
+        buffer, without copying the body
+
+        The headers are an email.message.Message with no payload, and the
+        body is a read-only view of the mail.
+    """
+    end, start = split_offsets(mailString)
+    headers = HeaderParser().parsestr(mailString[:end], headersonly=True)
+    retval = (headers, body_view(mailString, start))
+    return retval
 
 
 def splitMail(mailString):
     """ returns (header,body) of a mail given as string
+
+        The keys of the header-dict are in lower-case. The body is
+        returned as a string, which is a copy: use split_mail to get a
+        view of the body instead.
     """
-    msg = mimetools.Message(StringIO.StringIO(str(mailString)))
+    headers, body = split_mail(mailString)
 
     # Get headers
     mailHeader = {}
-    for (key, value) in msg.items():
-        mailHeader[key] = value
+    for (key, value) in headers.items():
+        mailHeader[key.lower()] = value
 
     # Get body
-    msg.rewindbody()
-    mailBody = msg.fp.read()
+    if isinstance(body, memoryview):
+        mailBody = body.tobytes()
+    else:
+        mailBody = str(body)
 
     return (mailHeader, mailBody)
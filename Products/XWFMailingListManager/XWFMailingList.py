@@ -17,12 +17,13 @@
 from __future__ import absolute_import, unicode_literals
 from cgi import escape
 from email import message_from_string
-from email.parser import Parser
+from email.parser import HeaderParser
 from inspect import stack as inspect_stack
-from logging import getLogger
+from logging import getLogger, DEBUG
 log = getLogger('XWFMailingList')
 from random import random
-# import transaction  # See line 1560 below
+from Acquisition import aq_base
+import transaction
 from zope.component import createObject, getMultiAdapter
 from zope.globalrequest import getRequest
 from AccessControl import ClassSecurityInfo
@@ -33,21 +34,78 @@ from gs.core import to_ascii
 from gs.group.member.canpost import (
     IGSPostingUser, Notifier as CanPostNotifier, UnknownEmailNotifier)
 from gs.profile.notify import NotifyUser
-from gs.group.list.base import EmailMessage
 from gs.group.list.check.interfaces import IGSValidMessage
 from gs.group.list.command import process_command, CommandResult
 from gs.group.list.sender import Sender
 from gs.group.list.store.interfaces import IStorageForEmailMessage
 from Products.XWFCore.XWFUtils import (get_group_by_siteId_and_groupId)
+from sqlalchemy.exc import NoSuchTableError
+from .delivery import (defer_delivery, deliver_posts, GRACE, MAX_ATTEMPTS,
+                       BACKOFF, MAX_BACKOFF)
+from .groupcounters import GroupCountersQuery
+from .inboundmessage import InboundMessage
+from .listcontext import call_in_list
+from .lrucache import LRUCache
+from .moderationqueue import ModerationQuery
+from .outbox import OutboxQuery
+from .patterns import get_matcher
+from .prefilter import MailHeaders, header_block
 from .queries import MemberQuery, MessageQuery
-from .utils import pin, getMailFromRequest
-from .MailBoxerTools import splitMail
+from .ratelimit import SenderLimiter
+from .spool import spool_message
+from .utils import (pin, getMailFromRequest, getMailBufferFromRequest,
+                    closeMailBuffer)
 UTF8 = 'utf-8'
 DIGEST = 3
 null_convert = lambda x: x
 # Simple return-Codes for web-callable-methods for the smtp2zope-gate
 TRUE = "TRUE"
 FALSE = "FALSE"
+# The keys of getValueFor that resolve a list of addresses
+RECIPIENT_KEYS = ('digestmaillist', 'maillist', 'moderator', 'moderatedlist')
+# The number of user objects that are loaded from the ZODB together
+USER_BATCH = 100
+# The IDs of the posts that this process has recently stored or held for
+# moderation, shared by all the threads. This is a quick short circuit; the
+# database is checked too.
+recentPosts = LRUCache(maxsize=4096, maxage=3600)
+
+
+# The checksums of the headers of the messages that this process has
+# recently finished with, so a message that is delivered twice is dropped
+# before it is parsed.
+recentMail = LRUCache(maxsize=4096, maxage=3600)
+# The messages recently received from each sender, for enforcing the
+# senderlimit and senderinterval properties
+senderLimiter = SenderLimiter()
+
+
+def prefetch_users(userFolder, uids):
+    '''Load the user objects for some user IDs from the ZODB in one
+round-trip, if the ZODB supports prefetching (ZODB 5 and later).'''
+    userFolder = aq_base(userFolder)
+    jar = getattr(userFolder, '_p_jar', None)
+    prefetch = getattr(jar, 'prefetch', None)
+    getOb = getattr(userFolder, '_getOb', None)
+    if (prefetch is None) or (getOb is None):
+        return
+    users = [getOb(uid, None) for uid in uids]
+    ghosts = [u for u in users if getattr(u, '_p_oid', None) is not None]
+    if ghosts:
+        prefetch(ghosts)
+
+
+def remember_posts(status, postIds):
+    '''Record posts as stored, if the transaction committed.'''
+    if status:
+        for postId in postIds:
+            recentPosts.set(postId, True)
+
+
+def remember_mail(status, mailKey):
+    '''Record a message as processed, if the transaction committed.'''
+    if status:
+        recentMail.set(mailKey, True)
 
 
 class XWFMailingList(Folder):
@@ -68,11 +126,6 @@ class XWFMailingList(Folder):
         {'id': 'mailto', 'type': 'string', 'mode': 'wd'},
         {'id': 'hashkey', 'type': 'string', 'mode': 'wd'}, )
 
-    # track the checksum of the last email sent. Volatile because we
-    # just want a quick short circuit (post ID is checked for uniqueness
-    # at the database level anyway)
-    _v_last_email_checksum = ''
-
     def __init__(self, id, title, mailto):
         """ Setup a mailing list with reasonable defaults."""
         self.id = id
@@ -113,6 +166,39 @@ class XWFMailingList(Folder):
         self._p_changed = 1
         return True
 
+    security.declarePrivate('mailto_manager')
+
+    def mailto_manager(self, container=None):
+        '''The list manager that indexes the mailto of this list, or None'''
+        if container is None:
+            container = self.aq_parent
+        if getattr(aq_base(container), 'register_mailto', None) is None:
+            retval = None
+        else:
+            retval = container
+        return retval
+
+    def manage_afterAdd(self, item, container):
+        Folder.manage_afterAdd(self, item, container)
+        manager = self.mailto_manager(container)
+        if (item is self) and (manager is not None):
+            manager.register_mailto(self.getId(), self.mailto)
+
+    def manage_beforeDelete(self, item, container):
+        manager = self.mailto_manager(container)
+        if (item is self) and (manager is not None):
+            manager.unregister_mailto(self.getId(), self.mailto)
+        Folder.manage_beforeDelete(self, item, container)
+
+    def _updateProperty(self, id, value):
+        # Keep the mailto index of the list manager up to date.
+        oldMailto = getattr(aq_base(self), 'mailto', '')
+        Folder._updateProperty(self, id, value)
+        manager = self.mailto_manager()
+        if (id == 'mailto') and (manager is not None):
+            manager.unregister_mailto(self.getId(), oldMailto)
+            manager.register_mailto(self.getId(), self.mailto)
+
     security.declareProtected('View', 'manage_mailboxer')
 
     def manage_mailboxer(self, REQUEST):
@@ -120,7 +206,38 @@ class XWFMailingList(Folder):
 
 Handles (un)subscription-requests and checks for loops etc & bulks mails to
 list. Checks that the message can be processed, checks for an email command,
-checks that the person can post, and then processes the email."""
+checks that the person can post, and then processes the email.
+
+Before anything else the headers are checked by ``prefilterMail``, so
+loops, duplicates, spam and floods are dropped before the message is parsed.
+
+If the ``spooldir`` property is set the message is written to the spool, and
+processed later by ``process_mailboxer`` in a worker thread.
+
+A large message that was uploaded as a file, and is on disk, is
+memory-mapped rather than read into memory, so the prefilter only reads the
+header block and the spool streams the message to disk. The message is
+read into memory when it is processed, as it must be parsed."""
+        mailBuffer = getMailBufferFromRequest(REQUEST)
+        try:
+            if self.prefilterMail(MailHeaders(mailBuffer)):
+                return FALSE
+            spoolDir = self.getValueFor('spooldir')
+            if spoolDir:
+                listPath = '/'.join(self.getPhysicalPath())
+                spool_message(spoolDir, listPath, mailBuffer,
+                              self.getValueFor('spoolworkers'))
+                return TRUE
+        finally:
+            closeMailBuffer(mailBuffer)
+        retval = self.process_mailboxer(REQUEST)
+        return retval
+
+    security.declarePrivate('process_mailboxer')
+
+    def process_mailboxer(self, REQUEST):
+        """Run a message through the check, command, can-post and process
+stages of the ``manage_mailboxer`` workflow."""
         message = self.message_from_request(REQUEST)
         if self.checkMail(message):
             return FALSE  # This code predates False...
@@ -133,6 +250,81 @@ checks that the person can post, and then processes the email."""
         retval = self.processMail(message, REQUEST)
         return retval
 
+    security.declarePrivate('prefilterMail')
+
+    def prefilterMail(self, headers):
+        '''Check a message for loops, duplicates, spam and floods, using
+        the headers alone.
+
+        RETURNS
+            * Unicode if the message should *not* be processed, or
+            * None if the message *should* be processed.'''
+        xmailer = self.getValueFor('xmailer')
+        if xmailer and (headers.get('X-Mailer', '') == xmailer):
+            retval = 'Mail loop'
+        elif self.mail_key(headers) in recentMail:
+            retval = 'Duplicate message'
+        elif self.is_spam(headers.block):
+            retval = 'Spam'
+        elif self.sender_limited(headers.sender):
+            retval = 'Sender limit'
+        else:
+            retval = None
+
+        if retval:
+            m = 'prefilterMail: {0} ({1}): {2}: message from <{3}>'
+            logMsg = m.format(self.getProperty('title', ''), self.getId(),
+                              retval, headers.sender)
+            log.warning(logMsg)
+        return retval
+
+    security.declarePrivate('mail_key')
+
+    def mail_key(self, headers):
+        retval = ('/'.join(self.getPhysicalPath()), headers.checksum)
+        return retval
+
+    security.declarePrivate('remember_mail')
+
+    def remember_mail(self, headers):
+        '''Record the message as processed, once the transaction has
+committed. This is only called once the message has been accepted (stored,
+or held for moderation) so a rejected message can be sent again.'''
+        t = transaction.get()
+        t.addAfterCommitHook(remember_mail, args=(self.mail_key(headers), ))
+
+    security.declarePrivate('is_spam')
+
+    def is_spam(self, text):
+        '''Does the text match one of the ``spamlist`` expressions?'''
+        retval = self.spamMatcher().search(text)
+        return retval
+
+    security.declarePrivate('spamMatcher')
+
+    def spamMatcher(self):
+        '''The compiled ``spamlist`` expressions, combined if possible.'''
+        retval = get_matcher(self.getValueFor('spamlist'))
+        return retval
+
+    security.declarePrivate('sender_limited')
+
+    def sender_limited(self, sender):
+        '''Has the sender sent more than ``senderlimit`` messages to the list
+in the last ``senderinterval`` seconds?'''
+        limit = self.getValueFor('senderlimit') or 0
+        interval = self.getValueFor('senderinterval') or 0
+        key = ('/'.join(self.getPhysicalPath()), (sender or '').lower())
+        retval = not senderLimiter.allow(key, limit, interval)
+        if retval:
+            m = 'sender_limited: {0} ({1}): more than {2} messages from '\
+                '<{3}> in {4} seconds; {5} rejected in all'
+            logMsg = m.format(self.getProperty('title', ''), self.getId(),
+                              limit, sender, interval,
+                              senderLimiter.rejected)
+            log.warning(logMsg)
+        return retval
+
     security.declareProtected('View', 'manage_listboxer')
 
     def manage_listboxer(self, REQUEST):
@@ -157,15 +349,22 @@ Web) then ``manage_mailboxer`` should be used."""
 
     def message_from_request(self, REQUEST):
         ''''''
+        mailString = getMailFromRequest(REQUEST)
+        retval = self.message_from_mail(mailString)
+        return retval
+
+    security.declarePrivate('message_from_mail')
+
+    def message_from_mail(self, mailString):
+        '''Create the message from the email as a string'''
         groupId = self.getId()
         siteId = self.getProperty('siteId', '')
-        mailString = getMailFromRequest(REQUEST)
 
         # --=mpj17=-- Because this is the first method called with the
         # email message it is far more cautious about checking the validity
         # of the message string.
         try:
-            retval = EmailMessage(
+            retval = InboundMessage(
                 mailString, list_title=self.getProperty('title', ''),
                 group_id=groupId, site_id=siteId,
                 sender_id_cb=self.get_mailUserId)
@@ -189,12 +388,11 @@ Web) then ``manage_mailboxer`` should be used."""
         action = REQUEST.get('action', '')
         if (REQUEST.get('pin') == pin(self.getValueFor('mailto'),
                                       self.getValueFor('hashkey'))):
-            mqueueName = self.getValueFor('mailqueue')
-            mqueueName = to_ascii(mqueueName) if mqueueName else b'mailq'
-            mqueue = self.restrictedTraverse(mqueueName)
             mid = REQUEST.get('mid', '-1')
+            # Remove the queued mail, so it is only processed once
+            mail = self.pop_moderatedMail(mid)
 
-            if not hasattr(mqueue, mid):
+            if mail is None:
                 if action in ['approve', 'discard']:
                     if hasattr(self, "mail_approve"):
                         return self.mail_approve(self, REQUEST,
@@ -211,16 +409,12 @@ Web) then ``manage_mailboxer`` should be used."""
                     else:
                         REQUEST.RESPONSE.setHeader(b'Content-type',
                                                    b'text/plain')
-                        if len(mqueue.objectValues()):
+                        if self.has_moderatedMail():
                             return "PENDING MAILS IN QUEUE!"
                         else:
                             return "NO PENDING MAILS IN QUEUE!"
 
-            mail = getattr(mqueue, mid).data
             REQUEST.set('Mail', mail)
-
-            # delete queued mail
-            mqueue.manage_delObjects([mid])
             if action == 'approve':
                 # relay mail to list
                 message = self.message_from_request(REQUEST)
@@ -246,6 +440,149 @@ Web) then ``manage_mailboxer`` should be used."""
         else:
             return "INVALID REQUEST! Please check your PIN."
 
+    security.declareProtected('View', 'manage_moderateMails')
+
+    def manage_moderateMails(self, REQUEST):
+        """ Approves / discards many mails for a moderated list at once.
+
+The ``mids`` parameter lists the IDs of the messages, and ``action`` is
+either ``approve`` or ``discard``. The messages are removed from the queue
+together, and the approved messages are stored and then sent together once
+the transaction has committed."""
+        action = REQUEST.get('action', '')
+        mids = REQUEST.get('mids', [])
+        if not isinstance(mids, (list, tuple)):
+            mids = [mids]
+        if ((action in ('approve', 'discard'))
+                and (REQUEST.get('pin') == pin(self.getValueFor('mailto'),
+                                               self.getValueFor('hashkey')))):
+            mails = self.pop_moderatedMails(mids)
+            if not mails:
+                if hasattr(self, "mail_approve"):
+                    return self.mail_approve(self, REQUEST,
+                                             msg="MAIL_NOT_FOUND")
+                else:
+                    REQUEST.RESPONSE.setHeader(b'Content-type',
+                                               b'text/plain')
+                    return "MAILS NOT FOUND! MAYBE THE MAILS WERE "\
+                        "ALREADY PROCESSED?"
+
+            if action == 'approve':
+                messages = [self.message_from_mail(mails[mid])
+                            for mid in mids if mid in mails]
+                self.listMails(messages)
+                status = 'MAIL_APPROVE'
+                m = '{0} MAILS APPROVED'
+            else:
+                status = 'MAIL_DISCARD'
+                m = '{0} MAILS DISCARDED'
+            if hasattr(self, "mail_approve"):
+                return self.mail_approve(self, REQUEST, msg=status)
+            else:
+                REQUEST.RESPONSE.setHeader(b'Content-type', b'text/plain')
+                return m.format(len(mails))
+
+        if hasattr(self, "mail_approve"):
+            return self.mail_approve(self, REQUEST, msg="INVALID_REQUEST")
+        else:
+            return "INVALID REQUEST! Please check your PIN and action."
+
+    security.declarePrivate('legacy_mqueue')
+
+    def legacy_mqueue(self):
+        '''The ZODB folder that held the moderated messages before they were
+stored in the ``moderation_queue`` table, or None. Any messages left in it
+are still processed.'''
+        mqueueName = self.getValueFor('mailqueue')
+        mqueueName = to_ascii(mqueueName) if mqueueName else b'mqueue'
+        retval = getattr(self.aq_explicit, mqueueName, None)
+        return retval
+
+    security.declarePrivate('moderation_queue')
+
+    def moderation_queue(self):
+        '''The queue of messages waiting for moderation, or ``None`` if the
+``moderation_queue`` table has not been created (see
+``sql/02-moderation-queue.sql``), in which case the legacy ZODB folder is
+used.'''
+        try:
+            retval = ModerationQuery(self)
+        except NoSuchTableError:
+            retval = None
+        return retval
+
+    security.declarePrivate('queue_moderatedMail')
+
+    def queue_moderatedMail(self, msg):
+        '''Hold a message for moderation'''
+        queue = self.moderation_queue()
+        if queue is not None:
+            queue.add(self.getProperty('siteId', ''), self.getId(),
+                      msg.post_id, msg.subject, msg.get('from'),
+                      msg.mailString)
+        else:
+            mqueue = self.legacy_mqueue()
+            # create a default-mailqueue if there is no mailqueue
+            if mqueue is None:
+                self.setValueFor('mailqueue', 'mqueue')
+                self.manage_addFolder(b'mqueue', 'Moderated Mail Queue')
+                mqueue = self.mqueue
+            title = "%s / %s" % (msg.subject, msg.get('from'))
+            mqueue.manage_addFile(msg.post_id, title=title,
+                                  file=msg.mailString,
+                                  content_type='text/plain')
+        self.remember_posts([msg.post_id])
+
+    security.declarePrivate('pop_moderatedMail')
+
+    def pop_moderatedMail(self, mid):
+        '''Remove a message from the moderation queue.
+
+:returns: The message as a string, or None if it is not in the queue.'''
+        retval = self.pop_moderatedMails([mid]).get(mid)
+        return retval
+
+    security.declarePrivate('pop_moderatedMails')
+
+    def pop_moderatedMails(self, mids):
+        '''Remove messages from the moderation queue.
+
+:returns: A dictionary mapping the IDs of the messages that were in the
+          queue to the messages.'''
+        siteId = self.getProperty('siteId', '')
+        queue = self.moderation_queue()
+        # Only the messages deleted by this request are processed, so
+        # concurrent moderators never both process a message.
+        if queue is not None:
+            retval = queue.pop(siteId, self.getId(), mids)
+        else:
+            retval = {}
+
+        missing = [to_ascii(mid) for mid in mids if mid not in retval]
+        mqueue = self.legacy_mqueue() if missing else None
+        if mqueue is not None:
+            legacy = {}
+            for mid in missing:
+                queued = mqueue._getOb(mid, None)
+                if queued is not None:
+                    legacy[mid] = str(queued.data)
+            if legacy:
+                mqueue.manage_delObjects(list(legacy.keys()))
+                retval.update(legacy)
+        return retval
+
+    security.declarePrivate('has_moderatedMail')
+
+    def has_moderatedMail(self):
+        '''Are there any messages waiting for moderation?'''
+        queue = self.moderation_queue()
+        mqueue = self.legacy_mqueue()
+        retval = ((queue is not None)
+                  and queue.has_pending(self.getProperty('siteId', ''),
+                                        self.getId()))
+        retval = retval or bool(mqueue is not None and mqueue.objectIds())
+        return retval
+
     security.declareProtected('Manage properties', 'setValueFor')
 
     def setValueFor(self, key, value):
@@ -262,78 +599,97 @@ calling appropriate handlers in ZODB'''
         # Use manage_changeProperties as default for setting properties
         prop_loc.manage_changeProperties({key: value})
 
+    security.declarePrivate('group_member_ids')
+
+    def group_member_ids(self, groupIds, memberIds=()):
+        """ Get the unique IDs of the members of the user-groups, followed
+by any extra member IDs. The order is preserved, and empty IDs are
+dropped."""
+        retval = []
+        seen = set()
+        groupUids = [self.acl_users.getGroupById(gid).getUsers()
+                     for gid in groupIds]
+        for uids in groupUids + [memberIds]:
+            for uid in uids:
+                if uid and (uid not in seen):
+                    seen.add(uid)
+                    retval.append(uid)
+        return retval
+
+    security.declarePrivate('iter_userObjects')
+
+    def iter_userObjects(self, uids):
+        """ Lazily get the user objects for some (unique) user IDs, skipping
+the users that cannot be found. The users are loaded from the ZODB in
+batches of ``USER_BATCH``, so a large group costs a round-trip per batch
+rather than one per member."""
+        uids = list(uids)
+        userFolder = self.acl_users
+        getUser = userFolder.getUser
+        for i in range(0, len(uids), USER_BATCH):
+            batch = uids[i:i + USER_BATCH]
+            prefetch_users(userFolder, batch)
+            for uid in batch:
+                user = getUser(uid)
+                if user:
+                    yield user
+
     security.declareProtected('Manage properties', 'get_memberUserObjects')
 
-    def get_memberUserObjects(self, ids_only=False):
+    def get_memberUserObjects(self, ids_only=False, lazy=False):
         """ Get the user objects corresponding to the membership list,
-assuming we can."""
+assuming we can. If lazy is True an iterator of the user objects is
+returned."""
         member_groups = self.getProperty('member_groups',
                                          ['%s_member' % self.listId()])
-        uids = []
-        for gid in member_groups:
-            group = self.acl_users.getGroupById(gid)
-            uids += group.getUsers()
+        uids = self.group_member_ids(member_groups)
 
         if ids_only:
             retval = uids
         else:
-            m = 'Getting all the user-objects in "%s"' % self.listId()
-            log.warning(m)
-            s = inspect_stack()[:2]
-            log.warning(s)
-            users = []
-            for uid in uids:
-                user = self.acl_users.getUser(uid)
-                if user:
-                    users.append(user)
-            retval = users
+            if log.isEnabledFor(DEBUG):
+                # Capturing the stack is expensive, so only do it when
+                # debugging
+                log.debug('Getting all the user-objects in "%s"',
+                          self.listId())
+                log.debug(inspect_stack()[:2])
+            users = self.iter_userObjects(uids)
+            retval = users if lazy else list(users)
         return retval
 
     security.declareProtected('Manage properties',
                               'get_moderatedUserObjects')
 
-    def get_moderatedUserObjects(self, ids_only=False):
+    def get_moderatedUserObjects(self, ids_only=False, lazy=False):
         """ Get the user objects corresponding to the moderated list,
 assuming we can."""
-        member_groups = self.getProperty('moderated_groups', [])
-        uids = []
-        for gid in member_groups:
-            group = self.acl_users.getGroupById(gid)
-            uids += group.getUsers()
-
-        uids += self.getProperty('moderated_members', [])
+        uids = self.group_member_ids(
+            self.getProperty('moderated_groups', []),
+            self.getProperty('moderated_members', []))
 
         if ids_only:
             return uids
 
-        # AM: Avoid nastiness associated with empty strings and null users
-        users = [x for x in [self.acl_users.getUser(uid)
-                             for uid in uids if uid] if x]
-
-        return users
+        users = self.iter_userObjects(uids)
+        retval = users if lazy else list(users)
+        return retval
 
     security.declareProtected('Manage properties',
                               'get_moderatorUserObjects')
 
-    def get_moderatorUserObjects(self, ids_only=False):
+    def get_moderatorUserObjects(self, ids_only=False, lazy=False):
         """ Get the user objects corresponding to the moderator, assuming
         we can."""
-        member_groups = self.getProperty('moderator_groups', [])
-        uids = []
-        for gid in member_groups:
-            group = self.acl_users.getGroupById(gid)
-            uids += group.getUsers()
-
-        uids += self.getProperty('moderator_members', [])
+        uids = self.group_member_ids(
+            self.getProperty('moderator_groups', []),
+            self.getProperty('moderator_members', []))
 
         if ids_only:
             return uids
 
-        # AM: Avoid nastiness associated with empty strings and null users
-        users = [x for x in [self.acl_users.getUser(uid)
-                             for uid in uids if uid] if x]
-
-        return users
+        users = self.iter_userObjects(uids)
+        retval = users if lazy else list(users)
+        return retval
 
     security.declareProtected('Access contents information', 'getValueFor')
 
@@ -341,8 +697,7 @@ assuming we can."""
         """ getting the maillist and moderatedlist is a special case,
         working in with the XWFT group framework."""
 
-        if key in ('digestmaillist', 'maillist', 'moderator',
-                   'moderatedlist'):
+        if key in RECIPIENT_KEYS:
             maillist = []
             if key in ('digestmaillist', 'maillist'):
                 maillist_script = getattr(self, 'maillist_members', None)
@@ -387,9 +742,13 @@ assuming we can."""
                         self.getProperty('siteId'), self.getId(),
                         self.get_moderatedUserObjects,
                         preferred_only=False, process_settings=False)
+                # A set, so each address is checked in constant time for a
+                # large group
+                seen = set(maillist)
                 for email in addresses:
                     email = email.strip()
-                    if email and email not in maillist:
+                    if email and email not in seen:
+                        seen.add(email)
                         maillist.append(email)
 
             except Exception as x:
@@ -437,41 +796,160 @@ assuming we can."""
 
     def listMail(self, msg):
         '''Store a message and send it. Named for the old MailBoxer
-        method'''
-        r = getRequest()  # The actual Zope request; FIXME
+        method.
+
+The message is stored, and added to the outbox, immediately. It is rendered
+and sent by a delivery worker once the transaction has committed (see the
+``delivery`` module). This keeps the transaction short, and means a retried
+transaction never sends the post twice.'''
         # Store mail in the archive
-        siteInfo = self.siteInfo()
         groupInfo = self.groupInfo()
         storage = getMultiAdapter((groupInfo, msg), IStorageForEmailMessage)
         storage.store()
+        self.count_posts([msg])
+        self.remember_posts([msg.post_id])
+        self.queue_posts([msg])
+        return msg.post_id
+
+    security.declarePrivate('listMails')
+
+    def listMails(self, msgs):
+        '''Store several messages, and send them all once the transaction
+has committed.'''
+        groupInfo = self.groupInfo()
+        for msg in msgs:
+            storage = getMultiAdapter((groupInfo, msg),
+                                      IStorageForEmailMessage)
+            storage.store()
+        self.count_posts(msgs)
+
+        retval = [msg.post_id for msg in msgs]
+        self.remember_posts(retval)
+        self.queue_posts(msgs)
+        return retval
+
+    security.declarePrivate('count_posts')
+
+    def count_posts(self, msgs):
+        '''Increment the post and topic counters of the group for stored
+messages. The counters are skipped if the ``group_counters`` table has not
+been created.'''
+        try:
+            counters = GroupCountersQuery(self)
+        except NoSuchTableError:
+            return
+        for msg in msgs:
+            counters.add_post(msg.topic_id, msg.post_id)
 
+    security.declarePrivate('remember_posts')
+
+    def remember_posts(self, postIds):
+        '''Add the posts to the recently-seen posts, once the transaction
+has committed.'''
+        t = transaction.get()
+        t.addAfterCommitHook(remember_posts, args=(list(postIds), ))
+
+    security.declarePrivate('outbox')
+
+    def outbox(self):
+        '''The outbox of posts waiting to be sent, or ``None`` if the
+``post_outbox`` table has not been created.'''
+        try:
+            retval = OutboxQuery(self)
+        except NoSuchTableError:
+            retval = None
+        return retval
+
+    security.declarePrivate('queue_posts')
+
+    def queue_posts(self, msgs):
+        '''Add stored posts to the outbox, and have a delivery worker send
+them once the transaction has committed.'''
+        if not msgs:
+            return
+        listPath = '/'.join(self.getPhysicalPath())
+        headers = dict((msg.post_id, header_block(msg.mailString))
+                       for msg in msgs)
+        outbox = self.outbox()
+        if outbox is not None:
+            siteId = self.getProperty('siteId', '')
+            for msg in msgs:
+                outbox.add(siteId, self.getId(), listPath, msg.post_id,
+                           headers[msg.post_id], delay=GRACE)
+        postIds = [msg.post_id for msg in msgs]
+        defer_delivery(deliver_posts, listPath, postIds, headers)
+
+    security.declarePrivate('send_queued_post')
+
+    def send_queued_post(self, postId, headers=None):
+        '''Send a post in the outbox, and remove it from the outbox.
+
+The outbox entry is locked until the transaction finishes, so the post is
+skipped if it is being sent by another transaction, or has been sent.
+
+:param str postId: The ID of the post.
+:param str headers: The header block of the post, as it was received. This
+                    is only used if the outbox table has not been created.'''
+        outbox = self.outbox()
+        if outbox is not None:
+            headers = outbox.claim(postId)
+            if headers is None:
+                log.info('Not sending the post "%s" as it has been sent, or '
+                         'is being sent', postId)
+                return
+        self.send_message(postId, headers or b'')
+        if outbox is not None:
+            outbox.remove(postId)
+
+    security.declarePrivate('post_delivery_failed')
+
+    def post_delivery_failed(self, postId, error):
+        '''Record that a post could not be sent, so it is retried.'''
+        outbox = self.outbox()
+        if outbox is None:
+            log.error('The post "%s" was not sent, and it will not be '
+                      'retried as there is no outbox', postId)
+        elif outbox.failed(postId, error, MAX_ATTEMPTS, BACKOFF,
+                           MAX_BACKOFF):
+            log.error('Giving up on sending the post "%s" after %d '
+                      'attempts', postId, MAX_ATTEMPTS)
+
+    security.declarePrivate('send_message')
+
+    def send_message(self, postId, headers):
+        '''Render a stored post as an email message, and send it.
+
+:param str postId: The ID of the post.
+:param str headers: The header block of the post, as it was received.
+:raises Exception: Any failure to render or send the post is raised, for
+                   ``delivery.deliver_posts`` to record.'''
+        r = getRequest()  # The actual Zope request; FIXME
+        siteInfo = self.siteInfo()
+        groupInfo = self.groupInfo()
+        messages = getattr(groupInfo.groupObj, 'messages')
         # Now generate the text, which is a page in the context of a post
         # Emulate how zope.publisher will do this
         log.info('Buiding a new email for post "%s" in %s (%s) on %s',
-                 msg.post_id, groupInfo.name, groupInfo.id, siteInfo.id)
-        messages = getattr(groupInfo.groupObj, 'messages')
+                 postId, groupInfo.name, groupInfo.id, siteInfo.id)
         emailTraversal = getMultiAdapter((messages, r), name='gs-group-list-email')
-        emailTraversal.publishTraverse(r, msg.post_id)  # This loads the post from the RDB
+        emailTraversal.publishTraverse(r, postId)  # This loads the post from the RDB
         # Call the message, causing it to render and dump out the plain-text and HTML versions
         # and chuck them into a multipart/alternative message
         outgoingEmail = emailTraversal()
 
-        # Build the new message, using the headers from the old message
-        newMail = "%s\r\n\r\nDropped text." % (msg.headers)
-        e = Parser().parsestr(newMail, headersonly=True)
-        # Add the headers to the message
-        for header, val in e.items():
+        # Add the headers from the old message, as it was received, to the
+        # new message
+        oldHeaders = HeaderParser().parsestr(headers, headersonly=True)
+        for header, val in oldHeaders.items():
             if header not in outgoingEmail:
                 outgoingEmail.add_header(header, val)
 
         # Send the new pessage
         log.info('Sending an email for post "%s" in %s (%s) on %s',
-                 msg.post_id, groupInfo.name, groupInfo.id, siteInfo.id)
+                 postId, groupInfo.name, groupInfo.id, siteInfo.id)
         sender = Sender(groupInfo.groupObj, r)
         sender.send(outgoingEmail)
 
-        return msg.post_id
-
     def processMail(self, msg, REQUEST):
         '''Do all the moderation processing, then list the message by
 calling ``self.listMail``'''
@@ -481,8 +959,8 @@ calling ``self.listMail``'''
 
         # FIXME: Should be in gs.group.list.check
         # First sanity check ... have we already archived this message?
-        messageQuery = MessageQuery(self)
-        if messageQuery.post(msg.post_id):
+        if ((msg.post_id in recentPosts)
+                or MessageQuery(self).post_exists(msg.post_id)):
             m = '%s (%s): Post from <%s> has already been archived with '\
                 'post ID %s' % (self.getProperty('title', ''), self.getId(),
                                 msg.sender, msg.post_id)
@@ -501,26 +979,23 @@ calling ``self.listMail``'''
                 (self.getProperty('title', ''), self.getId(),
                  msg.post_id, email)
             log.info(m)
-            modresult = self.processModeration(REQUEST)
+            modresult = self.processModeration(REQUEST, msg)
             if modresult:
                 return modresult
             # --=mpj17=-- No else?
 
+        self.remember_mail(MailHeaders(msg.mailString))
         retval = self.listMail(msg)
         return retval
 
-    def processModeration(self, REQUEST):
+    def processModeration(self, REQUEST, msg=None):
         # a hook for handling the moderation stage of processing the email
         m = '%s (%s) Processing moderation' %\
             (self.getProperty('title', ''), self.getId())
         log.info(m)
-        mailString = getMailFromRequest(REQUEST)
-        # TODO: erradicate splitMail usage
-        (header, body) = splitMail(mailString)
-        msg = EmailMessage(
-            mailString, list_title=self.getProperty('title', ''),
-            group_id=self.getId(), site_id=self.getProperty('siteId', ''),
-            sender_id_cb=self.get_mailUserId)
+        if msg is None:
+            msg = self.message_from_request(REQUEST)
+        mailString = msg.mailString
 
         # Get members who are on the list, whether or not they're receiving email
         memberlist = [member for member in self.getValueFor('maillist',True)]
@@ -553,23 +1028,12 @@ calling ``self.listMail``'''
             #There is no one moderated currently, and this person is on the list
             moderate = False
         else:
-            self.mail_reply(self, REQUEST, mailString)
+            self.mail_reply(self, REQUEST, mailString, msg.fromAddress)
             return msg.sender
 
         if moderate:
-            mqueue = getattr(self.aq_explicit, 'mqueue', None)
-
-            # create a default-mailqueue if the traverse to mailqueue
-            # fails...
-            if not mqueue:
-                self.setValueFor('mailqueue', 'mqueue')
-                self.manage_addFolder(b'mqueue', 'Moderated Mail Queue')
-                mqueue = self.mqueue
-
-            title = "%s / %s" % (msg.subject, msg.get('from'))
-
-            mqueue.manage_addFile(msg.post_id, title=title, file=mailString,
-                                  content_type='text/plain')
+            self.queue_moderatedMail(msg)
+            self.remember_mail(MailHeaders(mailString))
 
             # --=mpj17=-- Changed to use the GroupServer message
             # notification framework. Instead of a single call to the
@@ -577,7 +1041,7 @@ calling ``self.listMail``'''
             # two users.
 
             # self.mail_moderator(self, REQUEST, mid=msg.post_id,
-            #                    pin=pin, mail=header, body=body)
+            #                    pin=pin, mail=msg.headers, body=msg.body)
 
             #
             # FIXME: Moderation *totally* broken for the unclosed case
@@ -586,46 +1050,63 @@ calling ``self.listMail``'''
             assert moderatedUser, 'Moderated user %s not found' % \
                 msg.sender_id
 
-            moderators = self.get_moderatorUserObjects()
-            mun = moderatedUser.getProperty('fn', '')
-            for moderator in moderators:
-                nDict = {
-                    'mailingList': self,
-                    'pin': pin(self.getValueFor('mailto'),
-                               self.getValueFor('hashkey')),
-                    'moderatedUserAddress': msg.sender,
-                    'groupId': self.getId(),
-                    'groupName': self.title,
-                    'groupEmail': self.getValueFor('mailto'),
-                    'subject': msg.subject,
-                    'mid': msg.post_id,
-                    'body': msg.body,
-                    'absolute_url': self.absolute_url(),
-                    'moderatedUserId': msg.sender_id,
-                    'moderatedUserName': mun}
-                notify = NotifyUser(moderator)
-                notify.send_notification('mail_moderator', 'default',
-                                         n_dict=nDict)
-
+            # The notification is the same for everyone, so it is built
+            # once. It is sent by a delivery worker once the message has
+            # been queued (when the transaction commits).
+            mailto = self.getValueFor('mailto')
             nDict = {
-                'mailingList': self,
-                'pin': pin(self.getValueFor('mailto'),
-                           self.getValueFor('hashkey')),
+                'pin': pin(mailto, self.getValueFor('hashkey')),
                 'moderatedUserAddress': msg.sender,
                 'groupName': self.title,
-                'groupEmail': self.getValueFor('mailto'),
+                'groupEmail': mailto,
                 'subject': msg.subject,
                 'mid': msg.post_id,
                 'body': msg.body,
                 'absolute_url': self.absolute_url(),
                 'moderatedUserName': moderatedUser.getProperty('fn', '')}
+            moderatorIds = self.get_moderatorUserObjects(ids_only=True)
+            defer_delivery(call_in_list, '/'.join(self.getPhysicalPath()),
+                           'notify_moderation', moderatorIds, msg.sender_id,
+                           nDict)
+
+            return msg.sender
+        return False
 
+    security.declarePrivate('notify_moderation')
+
+    def notify_moderation(self, moderatorIds, moderatedUserId, nDict):
+        '''Tell the moderators, and the moderated member, that a message
+has been held for moderation.
+
+Each notification is sent separately, and a failure is logged, so one
+failure never stops the others being sent. The notifications are not
+retried: the message itself stays in the moderation queue, where the
+moderators can see it.'''
+        nDict = dict(nDict, mailingList=self)
+        moderatorDict = dict(nDict, groupId=self.getId(),
+                             moderatedUserId=moderatedUserId)
+        for moderator in self.iter_userObjects(moderatorIds):
+            # One moderator with a problem should not stop the others
+            # being told
+            try:
+                notify = NotifyUser(moderator)
+                notify.send_notification('mail_moderator', 'default',
+                                         n_dict=moderatorDict)
+            except Exception:
+                log.exception('Failed to notify the moderator %s of the '
+                              'post "%s"', moderator.getId(), nDict['mid'])
+
+        # A failure to tell the moderated member is logged, rather than
+        # raised, so it does not abort the transaction that has sent the
+        # notifications to the moderators.
+        try:
+            moderatedUser = self.acl_users.getUser(moderatedUserId)
             notify = NotifyUser(moderatedUser)
             notify.send_notification('mail_moderated_user', 'default',
                                      n_dict=nDict)
-
-            return msg.sender
-        return False
+        except Exception:
+            log.exception('Failed to notify the moderated member %s of the '
+                          'post "%s"', moderatedUserId, nDict['mid'])
 
     def checkMail(self, msg):
         '''Check the email for loops and spam.
@@ -635,12 +1116,7 @@ calling ``self.listMail``'''
 
         RETURNS
             * Unicode if the message should *not* be processed, or
-            * None if the message *should* be processed.
-
-        SIDE EFFECTS
-            If the user can post, "self._v_last_email_checksum" is set to
-            the ID of the message, which is calculated by
-            "emailmessage.EmailMessage".'''
+            * None if the message *should* be processed.'''
         try:
             groupInfo = self.groupInfo()
             m = 'checkMail: {0} ({1}) checking message from <{2}>'
@@ -665,9 +1141,6 @@ calling ``self.listMail``'''
             m = 'checkMail: {0} ({1}) message from <{2}> checks ok'
             logMsg = m.format(groupInfo.name, groupInfo.id, msg.sender)
             log.info(logMsg)
-            # Checksum to ensure we are not in a tight loop.
-            # --=mpj17=-- Is this in the right place?
-            self._v_last_email_checksum = msg.post_id
             retval = None  # Oddly, this is the success value
         else:
             retval = ivm.status
@@ -679,9 +1152,9 @@ calling ``self.listMail``'''
 
     def requestMail(self, msg):
         'Handle the email commands'
-        mailString = msg.message.as_string()
         request = getRequest()  # The actual Zope request; FIXME
-        r = process_command(self.groupInfo().groupObj, mailString, request)
+        r = process_command(self.groupInfo().groupObj, msg.messageString,
+                            request)
         if r == CommandResult.commandStop:
             return msg.sender
 
@@ -691,7 +1164,7 @@ calling ``self.listMail``'''
         groupInfo = self.groupInfo()
         insts = (groupInfo.groupObj, userInfo)
         postingInfo = getMultiAdapter(insts, IGSPostingUser)
-        mailString = msg.message.as_string()
+        mailString = msg.messageString
         if not(postingInfo.canPost) and not(userInfo.anonymous):
             message = '%s (%s): %s' % (userInfo.name, userInfo.id,
                                        postingInfo.status)
@@ -707,7 +1180,7 @@ calling ``self.listMail``'''
             message = m % (self.getProperty('title', ''), groupInfo.id,
                            msg.sender)
             log.info(message)
-            self.mail_reply(self, REQUEST, mailString)
+            self.mail_reply(self, REQUEST, mailString, msg.fromAddress)
             return message
 
         # If here then everything is fine.
@@ -718,14 +1191,16 @@ calling ``self.listMail``'''
 
     security.declarePrivate('mail_reply')
 
-    def mail_reply(self, context, REQUEST, message):
+    def mail_reply(self, context, REQUEST, message, emailAddress=None):
         """ A hook used by the MailBoxer framework, which we provide here as
         a clean default. """
         # The email message that is sent to unknown email addresses
         groupId = self.getId()
         group = get_group_by_siteId_and_groupId(self, self.siteInfo().id,
                                                 groupId)
-        emailAddress = message_from_string(message)['From']
+        if emailAddress is None:
+            # Only parse the message if the caller has not done so already
+            emailAddress = message_from_string(message)['From']
 
         notifier = UnknownEmailNotifier(group, REQUEST)
         notifier.notify(emailAddress, message)
@@ -9,8 +9,10 @@
 from AccessControl import ClassSecurityInfo
 from Products.PageTemplates.PageTemplateFile import PageTemplateFile
 from App.class_init import InitializeClass
+from BTrees.OOBTree import OOBTree
 from OFS.Folder import Folder
-from gs.cache import cache
+from gs.core import to_unicode_or_bust
+from .groupcounters import GroupCountersQuery
 
 import logging
 log = logging.getLogger('XWFMailingListManager.XWFMailingListManager')
@@ -58,6 +60,8 @@ class XWFMailingListManager(Folder):
         {'id': 'senderlimit', 'type': 'int', 'mode': 'wd'},
         {'id': 'senderinterval', 'type': 'int', 'mode': 'wd'},
         {'id': 'mailqueue', 'type': 'string', 'mode': 'wd'},
+        {'id': 'spooldir', 'type': 'string', 'mode': 'wd'},
+        {'id': 'spoolworkers', 'type': 'int', 'mode': 'wd'},
         {'id': 'getter', 'type': 'string', 'mode': 'wd'},
         {'id': 'setter', 'type': 'string', 'mode': 'wd'},
        )
@@ -86,9 +90,16 @@ class XWFMailingListManager(Folder):
     senderlimit = 10                # default: no more than 10 mails
     senderinterval = 600            # in 10 minutes (= 600 seconds) allowed
     mailqueue = 'mqueue'
+    spooldir = ''                   # default: process mail in the request
+    spoolworkers = 4
     getter = ''
     setter = ''
 
+    # The index from the (lower-case) mailto of each list to the list ID.
+    # Managers created before the index existed lack it until a list is
+    # added, changed or removed, or rebuild_mailtoIndex is called.
+    _mailtoIndex = None
+
     def __init__(self, id, title=''):
         """ Initialise a new instance of XWFMailingListManager.
 
@@ -98,6 +109,7 @@ class XWFMailingListManager(Folder):
         self.title = title
         self._setupMetadata()
         self.__initialised = 0
+        self._mailtoIndex = OOBTree()
 
     security.declareProtected('Add Mail Boxers', 'manage_afterAdd')
     def manage_afterAdd(self, item, container):
@@ -118,41 +130,96 @@ class XWFMailingListManager(Folder):
         except AttributeError:
             raise AttributeError("No such list %s" % list_id)
 
-    @cache('Products.XWFMailingListManager', lambda x, y: y, 3600)
+    @staticmethod
+    def mailto_key(mailto):
+        return to_unicode_or_bust(mailto).lower()
+
+    security.declarePrivate('build_mailtoIndex')
+    def build_mailtoIndex(self):
+        index = OOBTree()
+        for listObj in self.objectValues('XWF Mailing List'):
+            mailto = getattr(listObj.aq_base, 'mailto', '')
+            if mailto:
+                index[self.mailto_key(mailto)] = listObj.getId()
+        return index
+
+    security.declarePrivate('mailto_index')
+    def mailto_index(self):
+        """ Get the index from mailto to list ID, for looking up lists.
+
+        This never writes to the ZODB, as it is used when mail arrives. If
+        the persistent index has not been built yet a volatile one is
+        built, which lasts as long as the manager is in the cache.
+
+        """
+        retval = self._mailtoIndex
+        if retval is None:
+            retval = getattr(self, '_v_mailtoIndex', None)
+            if retval is None:
+                retval = self._v_mailtoIndex = self.build_mailtoIndex()
+        return retval
+
+    security.declarePrivate('persistent_mailtoIndex')
+    def persistent_mailtoIndex(self):
+        """ Get the persistent index from mailto to list ID, for changing
+        it. It is built if needed, which is only done when a list is
+        added, changed or removed.
+
+        """
+        if self._mailtoIndex is None:
+            self.rebuild_mailtoIndex()
+        return self._mailtoIndex
+
+    security.declareProtected('Manage properties', 'rebuild_mailtoIndex')
+    def rebuild_mailtoIndex(self):
+        """ Rebuild the index from mailto to list ID from the lists.
+
+        """
+        index = self.build_mailtoIndex()
+        self._mailtoIndex = index
+        self._v_mailtoIndex = None
+        log.info("rebuilt the mailto index of %s (%d lists)" %
+                 (self.getId(), len(index)))
+        return len(index)
+
+    security.declareProtected('Manage properties', 'reconcile_counters')
+    def reconcile_counters(self):
+        """ Set the post and topic counters of the groups from the topic
+        table, fixing any drift. The counters are only read once this has
+        been run, so run it once after upgrading, and then periodically
+        from a clock-server or cron.
+
+        """
+        retval = GroupCountersQuery(self).reconcile()
+        log.info("reconciled the counters of %d groups" % retval)
+        return retval
+
+    security.declarePrivate('register_mailto')
+    def register_mailto(self, listId, mailto):
+        """ Record that mail to mailto should go to the list listId.
+
+        """
+        if mailto:
+            self.persistent_mailtoIndex()[self.mailto_key(mailto)] = listId
+
+    security.declarePrivate('unregister_mailto')
+    def unregister_mailto(self, listId, mailto):
+        """ Remove the mailto of the list listId from the index.
+
+        """
+        if mailto:
+            index = self.persistent_mailtoIndex()
+            key = self.mailto_key(mailto)
+            if index.get(key) == listId:
+                del index[key]
+
     def get_listIdFromMailto(self, mailto):
         """ Get a contained list, given the list mailto.
 
         """
-        mailto = mailto.lower()
-        # then try to find it fast, using the LHS of the email address
-        listIds = self.objectIds('XWF Mailing List')
-
         assert mailto.find('@'), "No LHS/RHS with @ in mailto"
-
-        possibleId = mailto.split('@')[0]
-        possListIds = filter(None,
-                      [x.find(possibleId) >= 0 and x for x in listIds])
-        found = False  # Typical pessimism
-        for listId in possListIds:
-            listObj = getattr(self, listId)
-            list_mailto = getattr(listObj, 'mailto', '').lower()
-            if list_mailto:
-                if list_mailto == mailto:
-                    found = True
-                    break
-
-        # if we still haven't found it, wade through everything
-        if not found:
-            for listobj in self.objectValues('XWF Mailing List'):
-                list_mailto = getattr(listobj, 'mailto', '').lower()
-                listId = listobj.getId()
-                if list_mailto:
-                    if list_mailto == mailto:
-                        log.debug("found list (%s) from mailto (%s) by slow lookup" % (listId, mailto))
-                        found = True
-                        break
-        if not found:
-            listId = ''
+        listId = self.mailto_index().get(self.mailto_key(mailto), '')
+        if not listId:
             log.warn("did not find list from mailto (%s)" % mailto)
 
         return listId
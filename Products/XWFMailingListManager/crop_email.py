@@ -1,72 +1,156 @@
 # -*- coding: utf-8 *-*
+from hashlib import md5
+import re
+from .lrucache import LRUCache
 
+#: Lines that start with one of these start the body
+SEPARATORS = ('--', '==', '__', '~~', '- -')
+#: The attribution line of a quoted reply ("Dinsdale wrote:")
+WROTE = re.compile('wrote:', re.IGNORECASE)
+#: The cropped bodies, keyed by the post ID (or a hash of the body) and the
+#: crop parameters. The cost of an item is its length, so the cache holds
+#: about 32M characters at most.
+cropped = LRUCache(maxsize=8192, maxcost=32 * 1024 * 1024)
 
-def crop_email(text, lines=0, max_consecutive_comment=12,
+
+def trimmable(line, stripped):
+    '''Can the line be moved from the end of the intro to the body?
+
+Short quoted lines, blank lines, attribution lines, and lines that are a
+single word (such as a signature) are trimmed from the end of the intro.'''
+    if (len(line) <= 3) and ((not stripped) or (stripped[0] == '>')):
+        retval = True
+    elif line.find('wrote:') > 2:
+        retval = True
+    else:
+        retval = bool(stripped) and (len(stripped.split(None, 1)) == 1)
+    return retval
+
+
+def crop_lines(lines, max_consecutive_comment=12,
                max_consecutive_whitespace=3):
-    slines = text.split('\n')
-    intro = []
-    body = []
-    i = 1
-    bodystart = 0
+    '''Split the lines of a message into the intro and the body.
+
+:param lines: The lines of the message, without the line-endings. Any
+              iterable can be used, such as a generator.
+:returns: A generator of ``(inBody, line)`` 2-tuples, in the order of the
+          lines. All the lines in the intro come before those in the body.
+
+Each line is looked at once, so the time taken is linear in the number of
+lines. The only lines that are held back are the run of trimmable lines at
+the end of the intro, which cannot be placed until the next line has been
+seen.'''
+    inBody = False
+    nIntro = 0
+    pending = []  # The trimmable lines at the end of the intro
     consecutive_comment = 0
     consecutive_whitespace = 0
-    for line in slines:
-        if (line[:2] == '--' or line[:2] == '==' or line[:2] == '__' or
-                line[:2] == '~~' or line[:3] == '- -'):
-            bodystart = 1
+    wrote = WROTE.search
+    for i, line in enumerate(lines, 1):
+        if inBody:
+            yield (True, line)
+            continue
 
-        if bodystart:
-            # if we've started on the body, just append to body
-            body.append(line)
-        elif consecutive_comment >= max_consecutive_comment and i > 25:
+        if line.startswith(SEPARATORS):
+            inBody = True
+        elif ((consecutive_comment >= max_consecutive_comment)
+                and (i > 25)):
             # Count comments, but don't penalise top quoting as badly
-            body.append(line)
-            bodystart = 1
-        elif (i <= 15):
-            # if we've got less than 15 lines, just put it in the intro
-            intro.append(line)
-        elif (len(line) > 3 and line[:4] != '>'):
-            intro.append(line)
-        elif consecutive_whitespace <= max_consecutive_whitespace:
-            intro.append(line)
+            inBody = True
+        elif ((i > 15) and (len(line) <= 3)
+                and (consecutive_whitespace > max_consecutive_whitespace)):
+            # Too much whitespace after the first 15 lines
+            inBody = True
+
+        if inBody:
+            # The trimmable lines are only trimmed from a long intro
+            trim = nIntro >= 5
+            for p in pending:
+                yield (trim, p)
+            pending = []
+            yield (True, line)
+            continue
+
+        nIntro += 1
+        stripped = line.strip()
+        if trimmable(line, stripped):
+            pending.append(line)
         else:
-            body.append(line)
-            bodystart = 1
+            if pending:
+                for p in pending:
+                    yield (False, p)
+                pending = []
+            yield (False, line)
 
-        if ((len(line) > 3)
-                and (line[:4] == '<' or line.lower().find('wrote:') != -1)):
+        if wrote(line):
             consecutive_comment += 1
         else:
             consecutive_comment = 0
 
-        if len(line.strip()):
+        if stripped:
             consecutive_whitespace = 0
         else:
             consecutive_whitespace += 1
-        i += 1
-
-    rintro = []
-    trim = 1
-    for line in intro[::-1]:
-        if len(intro) < 5:
-            trim = 0
-        if len(line) > 3:
-            ls = line[:4]
-        elif line.strip():
-            ls = line.strip()[0]
-        else:
-            ls = ''
-
-        if trim and (ls == '>' or ls == ''):
-            body.insert(0, line)
-        elif trim and line.find('wrote:') > 2:
-            body.insert(0, line)
-        elif trim and line.strip() and len(line.strip().split()) == 1:
-            body.insert(0, line)
+
+    trim = nIntro >= 5
+    for p in pending:
+        yield (trim, p)
+
+
+def crop_email(text, lines=0, max_consecutive_comment=12,
+               max_consecutive_whitespace=3):
+    intro = []
+    body = []
+    for inBody, line in crop_lines(text.split('\n'), max_consecutive_comment,
+                                   max_consecutive_whitespace):
+        if inBody:
+            body.append(line)
         else:
-            trim = 0
-            rintro.insert(0, line)
+            intro.append(line)
 
-    intro = '\n'.join(rintro)
+    intro = '\n'.join(intro)
     body = '\n'.join(body)
     return intro, body
+
+
+def body_key(text):
+    '''The cache-key for a body that lacks a post ID.'''
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    retval = ('md5', md5(text).hexdigest())
+    return retval
+
+
+def cached_crop_email(text, lines=0, max_consecutive_comment=12,
+                      max_consecutive_whitespace=3, post_id=None):
+    '''Crop the text, like ``crop_email``, keeping the result in a cache.
+
+:param post_id: The ID of the post. Posts are never edited, so the ID
+                is used as the cache key. If it is ``None`` then a hash of
+                the text is used.'''
+    if post_id is None:
+        textKey = body_key(text)
+    else:
+        textKey = ('post', post_id)
+    key = (textKey, lines, max_consecutive_comment,
+           max_consecutive_whitespace)
+    retval = cropped.get(key)
+    if retval is None:
+        retval = crop_email(text, lines, max_consecutive_comment,
+                            max_consecutive_whitespace)
+        cropped.set(key, retval, cost=len(retval[0]) + len(retval[1]))
+    return retval
+
+
+def crop_posts(posts, lines=0, max_consecutive_comment=12,
+               max_consecutive_whitespace=3):
+    '''Crop the bodies of many posts, such as all the posts in a topic.
+
+:param posts: The posts, as returned by ``MessageQuery.topic_posts``.
+:returns: The ``(intro, body)`` 2-tuples, in the same order as the posts.'''
+    retval = [cached_crop_email(post['body'], lines,
+                                max_consecutive_comment,
+                                max_consecutive_whitespace,
+                                post.get('post_id'))
+              for post in posts]
+    return retval
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+'''Deliver posts after the transaction that stored them has committed
+
+If a ZODB ``ConflictError`` causes Zope to retry a request then everything
+in the request is run again, and rendering and sending a post is slow. So
+``listMail`` only stores the post, and adds it to the outbox (see
+``outbox.OutboxQuery``) in the same transaction. Once that transaction has
+committed an after-commit hook passes the post IDs to the delivery workers,
+which are threads of their own. The hook does nothing else.
+
+A worker sends each post in a Zope connection and transaction of its own
+(see ``listcontext.list_context``). The outbox entry is locked while the
+post is sent, and deleted in the transaction that sends it, so the post ID
+is the key that stops a post being sent twice, even by different ZEO
+clients. If sending fails the entry stays in the outbox, and the post is
+retried with an exponential backoff by the sweep that the workers run
+every ``SWEEP_INTERVAL`` seconds. After ``MAX_ATTEMPTS`` failures the entry
+is marked as dead, and kept so an administrator can look at it.
+
+If the ``post_outbox`` table has not been created the posts are still sent
+by the workers, but a failure is only logged.
+
+The workers are started when Zope starts (see ``start_delivery``), so the
+sweep picks up the posts that were waiting when Zope stopped.'''
+from __future__ import absolute_import, unicode_literals
+from Queue import Queue
+from threading import Lock, Thread
+from time import sleep
+from traceback import format_exc
+from logging import getLogger
+log = getLogger('XWFMailingListManager.delivery')
+import transaction
+from sqlalchemy.exc import NoSuchTableError
+from .listcontext import call_in_list
+from .outbox import OutboxQuery
+
+#: The number of delivery threads in each process
+WORKERS = 2
+#: The number of times a post is tried before it is declared dead
+MAX_ATTEMPTS = 8
+#: The delay before the first retry, in seconds. It doubles each time.
+BACKOFF = 60
+#: The longest delay between retries, in seconds
+MAX_BACKOFF = 3600
+#: How often the outbox is swept for the posts that should be retried
+SWEEP_INTERVAL = 60
+#: How long a new post is left for the worker that it was passed to,
+#: before the sweep will try to send it
+GRACE = 300
+
+
+def deliver_posts(listPath, postIds, headers):
+    '''Send posts, each in a transaction of its own.
+
+:param str listPath: The physical path to the mailing list.
+:param list postIds: The IDs of the posts to send.
+:param dict headers: The header blocks of the posts, keyed by post ID. These
+                     are only used if the outbox table has not been
+                     created.'''
+    for postId in postIds:
+        try:
+            call_in_list(listPath, 'send_queued_post', postId,
+                         headers.get(postId))
+        except Exception:
+            error = format_exc()
+            log.error('Failed to send the post "%s" to %s:\n%s', postId,
+                      listPath, error)
+            try:
+                call_in_list(listPath, 'post_delivery_failed', postId, error)
+            except Exception:
+                log.exception('Failed to record that the post "%s" was not '
+                              'sent', postId)
+
+
+def sweep_outbox():
+    '''Retry the posts in the outbox that are due.'''
+    transaction.begin()
+    try:
+        due = OutboxQuery(None).due()
+        transaction.commit()
+    except NoSuchTableError:
+        transaction.abort()
+        return
+    except:
+        transaction.abort()
+        raise
+    byList = {}
+    for listPath, postId in due:
+        byList.setdefault(listPath, []).append(postId)
+    for listPath, postIds in byList.items():
+        log.info('Retrying %d posts to %s', len(postIds), listPath)
+        deliver_posts(listPath, postIds, {})
+
+
+class DeliveryWorkers(object):
+    '''The threads that deliver the posts, and sweep the outbox.'''
+
+    def __init__(self, numWorkers=WORKERS, sweepInterval=SWEEP_INTERVAL):
+        self.numWorkers = max(numWorkers, 1)
+        self.sweepInterval = sweepInterval
+        self.queue = Queue()
+        self.threads = []
+
+    def start(self):
+        for i in range(self.numWorkers):
+            t = Thread(target=self.work, name='delivery-worker-{0}'.format(i))
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+        t = Thread(target=self.sweep, name='delivery-sweeper')
+        t.daemon = True
+        t.start()
+        self.threads.append(t)
+
+    def put(self, callback, args):
+        self.queue.put((callback, args))
+
+    def work(self):
+        while True:
+            callback, args = self.queue.get()
+            try:
+                callback(*args)
+            except Exception:
+                log.exception('Failed to make the delivery %s%r',
+                              getattr(callback, '__name__', callback), args)
+
+    def sweep(self):
+        while True:
+            sleep(self.sweepInterval)
+            try:
+                sweep_outbox()
+            except Exception:
+                log.exception('Failed to sweep the outbox')
+
+
+_workers = None
+_workersLock = Lock()
+
+
+def get_delivery_workers():
+    '''Get the (running) delivery workers of this process.'''
+    global _workers
+    with _workersLock:
+        if _workers is None:
+            _workers = DeliveryWorkers()
+            _workers.start()
+    return _workers
+
+
+def start_delivery(event):
+    '''Start the delivery workers when the database is opened as Zope
+starts.'''
+    get_delivery_workers()
+
+
+def queue_delivery(status, callback, args):
+    '''The after-commit hook that passes a delivery to the workers.'''
+    if status:
+        get_delivery_workers().put(callback, args)
+    else:
+        log.info('Not making the delivery %s%r as the transaction was '
+                 'aborted', getattr(callback, '__name__', callback), args)
+
+
+def defer_delivery(callback, *args):
+    '''Call ``callback(*args)`` in a delivery worker once the current
+transaction has committed.
+
+:param callback: The callable that makes the delivery. It is called outside
+                 of any transaction, so the arguments must be plain data
+                 rather than persistent objects; ``call_in_list`` opens the
+                 mailing list again.'''
+    t = transaction.get()
+    t.addAfterCommitHook(queue_delivery, args=(callback, args))
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+from __future__ import absolute_import, unicode_literals
+from threading import Lock
+import sqlalchemy as sa
+from gs.database import getTable, getSession
+
+#: Count a post that has just been stored, and its topic if the post
+#: started it
+ADD_POST = '''
+INSERT INTO group_counters (site_id, group_id, num_posts, num_topics)
+  SELECT topic.site_id, topic.group_id, 1,
+         CASE WHEN topic.first_post_id = :post_id THEN 1 ELSE 0 END
+    FROM topic
+    WHERE topic.topic_id = :topic_id
+  ON CONFLICT (site_id, group_id) DO UPDATE
+    SET num_posts = group_counters.num_posts + EXCLUDED.num_posts,
+        num_topics = group_counters.num_topics + EXCLUDED.num_topics;'''
+
+#: Set the counters from the topic table
+RECONCILE = '''
+INSERT INTO group_counters (site_id, group_id, num_posts, num_topics)
+  SELECT site_id, group_id, COALESCE(SUM(num_posts), 0), COUNT(topic_id)
+    FROM topic
+    WHERE (:site_id IS NULL) OR (site_id = :site_id)
+    GROUP BY site_id, group_id
+  ON CONFLICT (site_id, group_id) DO UPDATE
+    SET num_posts = EXCLUDED.num_posts,
+        num_topics = EXCLUDED.num_topics
+    WHERE (group_counters.num_posts, group_counters.num_topics)
+      IS DISTINCT FROM (EXCLUDED.num_posts, EXCLUDED.num_topics);'''
+
+#: Record that the counters of the sites have been set from the topic table
+MARK_RECONCILED = '''
+INSERT INTO group_counters_reconciled (site_id)
+  SELECT DISTINCT site_id
+    FROM group_counters
+    WHERE (:site_id IS NULL) OR (site_id = :site_id)
+  ON CONFLICT (site_id) DO UPDATE
+    SET date = now();'''
+
+#: Zero the counters of the groups that no longer have any topics
+RECONCILE_EMPTY = '''
+UPDATE group_counters
+  SET num_posts = 0, num_topics = 0
+  WHERE ((:site_id IS NULL) OR (site_id = :site_id))
+    AND ((num_posts <> 0) OR (num_topics <> 0))
+    AND NOT EXISTS (SELECT 1 FROM topic
+                      WHERE topic.site_id = group_counters.site_id
+                        AND topic.group_id = group_counters.group_id);'''
+
+
+#: The sites whose counters are known to have been reconciled, shared by
+#: all the threads. A site stays reconciled, so this only grows.
+reconciledSites = set()
+reconciledSitesLock = Lock()
+
+
+class GroupCountersQuery(object):
+    '''The number of posts and topics in each group.
+
+The counters are kept in the ``group_counters`` table (see
+``sql/04-group-counters.sql``). They are incremented as each post is stored
+by ``listMail``, so the totals for a site can be read without adding up the
+``topic`` table. Posts that are changed by other products (such as hidden
+posts) can make the counters drift, so ``reconcile`` should be run
+periodically to set them from the ``topic`` table.
+
+The counters of a site are only correct once they have been reconciled,
+because posts can be stored by an older version of this product after the
+table is created. ``is_reconciled`` says if the counters of a site can be
+read.'''
+
+    def __init__(self, context):
+        self.context = context
+        self.countersTable = getTable('group_counters')
+        self.reconciledTable = getTable('group_counters_reconciled')
+
+    def add_post(self, topic_id, post_id):
+        """ Count a post that has just been stored in a topic.
+
+            The topic is counted too, if the post is the first post in the
+            topic.
+
+        """
+        session = getSession()
+        session.execute(sa.text(ADD_POST), params={'topic_id': topic_id,
+                                                   'post_id': post_id})
+
+    def is_reconciled(self, site_id):
+        """ Have the counters of the site been set from the topic table?
+
+        """
+        with reconciledSitesLock:
+            if site_id in reconciledSites:
+                return True
+        gcrt = self.reconciledTable
+        s = sa.select([gcrt.c.site_id], limit=1)
+        s.append_whereclause(gcrt.c.site_id == site_id)
+        statement = sa.select([sa.exists(s)])
+
+        session = getSession()
+        r = session.execute(statement)
+        retval = bool(r.scalar())
+        if retval:
+            with reconciledSitesLock:
+                reconciledSites.add(site_id)
+        return retval
+
+    def counts(self, site_id, group_ids=None):
+        """ Count the posts and topics in some groups.
+
+            Returns:
+                (num_posts, num_topics)
+
+        """
+        gct = self.countersTable
+        statement = sa.select([sa.func.sum(gct.c.num_posts),
+                               sa.func.sum(gct.c.num_topics)])
+        statement.append_whereclause(gct.c.site_id == site_id)
+        if group_ids:
+            statement.append_whereclause(gct.c.group_id.in_(group_ids))
+
+        session = getSession()
+        r = session.execute(statement).fetchone()
+        retval = (int(r[0] or 0), int(r[1] or 0))
+        return retval
+
+    def reconcile(self, site_id=None):
+        """ Set the counters from the topic table, fixing any drift.
+
+            Returns:
+                The number of groups that were changed.
+
+        """
+        session = getSession()
+        params = {'site_id': site_id}
+        r = session.execute(sa.text(RECONCILE), params=params)
+        retval = r.rowcount
+        r = session.execute(sa.text(RECONCILE_EMPTY), params=params)
+        retval += r.rowcount
+        session.execute(sa.text(MARK_RECONCILED), params=params)
+        return retval
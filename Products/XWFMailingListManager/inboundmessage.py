@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+from __future__ import absolute_import, unicode_literals
+from zope.cachedescriptors.property import Lazy
+from gs.group.list.base import EmailMessage
+
+
+class InboundMessage(EmailMessage):
+    '''An email message that has arrived at a mailing list.
+
+The message is parsed once, when it arrives, and this object is passed
+through every stage of the ``manage_mailboxer`` pipeline. The raw message,
+and the views of it that the stages need, are cached here so the stages
+never have to parse or serialise the message again.'''
+
+    def __init__(self, mailString, **kwargs):
+        EmailMessage.__init__(self, mailString, **kwargs)
+        # The message exactly as it was received
+        self.mailString = mailString
+
+    @Lazy
+    def messageString(self):
+        'The parsed message, serialised back to a string'
+        retval = self.message.as_string()
+        return retval
+
+    @Lazy
+    def fromAddress(self):
+        'The raw value of the From header'
+        retval = self.message['From']
+        return retval
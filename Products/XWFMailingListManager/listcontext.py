@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+'''Work with a mailing list from a thread that is outside a Zope request'''
+from __future__ import absolute_import, unicode_literals
+from contextlib import contextmanager
+import transaction
+from zope.component.hooks import setSite
+from zope.component.interfaces import ISite
+from zope.globalrequest import setRequest, clearRequest
+from Testing.makerequest import makerequest
+import Zope2
+
+
+@contextmanager
+def list_context(listPath):
+    '''Open a mailing list in a new Zope connection and transaction.
+
+:param str listPath: The physical path to the mailing list.
+:returns: A context manager that provides the mailing list. The transaction
+          is committed when the block finishes, or aborted if the block
+          raises an exception.
+
+The connection has a request (from ``makerequest``) and the site of the list
+is set, as they would be during a request. The transaction belongs to the
+current thread, so this must not be used from a thread that is already in a
+transaction, such as a request thread or an after-commit hook.'''
+    app = Zope2.app()
+    try:
+        root = makerequest(app)
+        setRequest(root.REQUEST)
+        transaction.begin()
+        try:
+            mailingList = root.unrestrictedTraverse(listPath)
+            sites = [o for o in mailingList.aq_chain if ISite.providedBy(o)]
+            if sites:
+                setSite(sites[0])
+            yield mailingList
+            transaction.commit()
+        except:
+            transaction.abort()
+            raise
+    finally:
+        setSite(None)
+        clearRequest()
+        app._p_jar.close()
+
+
+def call_in_list(listPath, methodName, *args, **kwargs):
+    '''Call a method of a mailing list in a new Zope connection and
+transaction (see ``list_context``).
+
+:returns: The result of the method.'''
+    with list_context(listPath) as mailingList:
+        retval = getattr(mailingList, methodName)(*args, **kwargs)
+    return retval
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+from __future__ import absolute_import, unicode_literals
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+
+class LRUCache(object):
+    '''A thread-safe, bounded, least-recently-used cache.
+
+:param int maxsize: The maximum number of items in the cache.
+:param maxage: The number of seconds an item stays in the cache, or
+               ``None`` if items never expire.
+:param maxcost: The maximum total cost of the items in the cache, or
+                ``None`` for no limit. The cost of an item is given when it
+                is set; it is normally the size of the item, so the cache
+                can be capped by memory as well as by the number of items.
+
+The cache lives in the memory of the process, and is shared by all the
+threads.'''
+
+    def __init__(self, maxsize=1024, maxage=None, maxcost=None):
+        self.maxsize = maxsize
+        self.maxage = maxage
+        self.maxcost = maxcost
+        self._data = OrderedDict()  # key -> (expires, value, cost)
+        self._lock = Lock()
+        self.cost = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value, cost = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if (expires is not None) and (expires < time()):
+                self.cost -= cost
+                self.misses += 1
+                return default
+            # Re-insert, to make the item the most recently used
+            self._data[key] = (expires, value, cost)
+            self.hits += 1
+        return value
+
+    def set(self, key, value, cost=1):
+        expires = None if self.maxage is None else (time() + self.maxage)
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (expires, value, cost)
+            self.cost += cost
+            while ((len(self._data) > self.maxsize)
+                   or ((self.maxcost is not None)
+                       and (self.cost > self.maxcost) and self._data)):
+                k, (e, v, c) = self._data.popitem(last=False)
+                self.cost -= c
+
+    def _pop(self, key):
+        try:
+            expires, value, cost = self._data.pop(key)
+        except KeyError:
+            pass
+        else:
+            self.cost -= cost
+
+    def invalidate(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.cost = 0
+
+    def __contains__(self, key):
+        marker = object()
+        retval = self.get(key, marker) is not marker
+        return retval
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+from __future__ import absolute_import, unicode_literals
+from zlib import compress, decompress
+import sqlalchemy as sa
+from gs.core import to_unicode_or_bust as to_unicode
+from gs.database import getTable, getSession
+
+
+class ModerationQuery(object):
+    '''The messages that are waiting for moderation.
+
+The messages are stored, compressed, in the ``moderation_queue`` table
+(see ``sql/02-moderation-queue.sql``). They are always looked up by site
+and group, as well as by post ID, so a moderator of one group can never
+see the messages held in another.'''
+
+    def __init__(self, context):
+        self.context = context
+        self.queueTable = getTable('moderation_queue')
+
+    def add(self, site_id, group_id, post_id, subject, sender, mailString):
+        mqt = self.queueTable
+        i = mqt.insert()
+        session = getSession()
+        session.execute(i, params={'post_id': post_id,
+                                   'site_id': site_id,
+                                   'group_id': group_id,
+                                   'subject': subject or '',
+                                   'sender': sender or '',
+                                   'message': compress(mailString)})
+
+    def messages(self, site_id, group_id, post_ids):
+        """ Retrieve queued messages.
+
+            Returns:
+                {post_id: mailString, ...}
+
+        """
+        if not post_ids:
+            return {}
+        mqt = self.queueTable
+        statement = sa.select([mqt.c.post_id, mqt.c.message])
+        statement.append_whereclause(mqt.c.site_id == site_id)
+        statement.append_whereclause(mqt.c.group_id == group_id)
+        statement.append_whereclause(mqt.c.post_id.in_(post_ids))
+
+        session = getSession()
+        r = session.execute(statement)
+        retval = dict((row['post_id'], decompress(row['message']))
+                      for row in r)
+        return retval
+
+    def message(self, site_id, group_id, post_id):
+        """ Retrieve a queued message, or None if it is not in the queue.
+
+        """
+        retval = self.messages(site_id, group_id, [post_id]).get(post_id)
+        return retval
+
+    def remove(self, site_id, group_id, post_ids):
+        """ Remove messages from the queue, returning the number removed.
+
+        """
+        if not post_ids:
+            return 0
+        mqt = self.queueTable
+        d = mqt.delete(sa.and_(mqt.c.site_id == site_id,
+                               mqt.c.group_id == group_id,
+                               mqt.c.post_id.in_(post_ids)))
+        session = getSession()
+        r = session.execute(d)
+        return r.rowcount
+
+    def pop(self, site_id, group_id, post_ids):
+        """ Remove messages from the queue, and retrieve them, in one
+            statement.
+
+            Only the messages that this statement deleted are returned, so
+            if two moderators approve the same message at the same time
+            only one of them gets it.
+
+            Returns:
+                {post_id: mailString, ...}
+
+        """
+        if not post_ids:
+            return {}
+        mqt = self.queueTable
+        d = mqt.delete(sa.and_(mqt.c.site_id == site_id,
+                               mqt.c.group_id == group_id,
+                               mqt.c.post_id.in_(post_ids)))
+        d = d.returning(mqt.c.post_id, mqt.c.message)
+        session = getSession()
+        r = session.execute(d)
+        retval = dict((row['post_id'], decompress(row['message']))
+                      for row in r)
+        return retval
+
+    def has_pending(self, site_id, group_id):
+        mqt = self.queueTable
+        s = sa.select([mqt.c.post_id], limit=1)
+        s.append_whereclause(mqt.c.site_id == site_id)
+        s.append_whereclause(mqt.c.group_id == group_id)
+        statement = sa.select([sa.exists(s)])
+
+        session = getSession()
+        r = session.execute(statement)
+        retval = bool(r.scalar())
+        return retval
+
+    def count(self, site_id, group_id):
+        mqt = self.queueTable
+        statement = sa.select([sa.func.count(mqt.c.post_id)])
+        statement.append_whereclause(mqt.c.site_id == site_id)
+        statement.append_whereclause(mqt.c.group_id == group_id)
+
+        session = getSession()
+        r = session.execute(statement)
+        retval = r.scalar()
+        return retval
+
+    def queued(self, site_id, group_id, limit=20, offset=0):
+        """ List the queued messages, oldest first, without the messages
+            themselves.
+
+            Returns:
+                ({'post_id': ID, 'date': Date, 'subject': String,
+                  'sender': String}, ...)
+
+        """
+        mqt = self.queueTable
+        cols = [mqt.c.post_id, mqt.c.date, mqt.c.subject, mqt.c.sender]
+        statement = sa.select(cols, limit=limit, offset=offset,
+                              order_by=(sa.asc(mqt.c.date),
+                                        sa.asc(mqt.c.post_id)))
+        statement.append_whereclause(mqt.c.site_id == site_id)
+        statement.append_whereclause(mqt.c.group_id == group_id)
+
+        session = getSession()
+        r = session.execute(statement)
+        retval = [{'post_id': row['post_id'],
+                   'date': row['date'],
+                   'subject': to_unicode(row['subject']),
+                   'sender': to_unicode(row['sender'])} for row in r]
+        return retval
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+from __future__ import absolute_import, unicode_literals
+from datetime import timedelta
+from zlib import compress, decompress
+import sqlalchemy as sa
+from gs.database import getTable, getSession
+
+#: Lock an outbox entry, skipping it if another transaction is sending it
+CLAIM = '''
+SELECT headers
+  FROM post_outbox
+  WHERE post_id = :post_id AND NOT dead
+  FOR UPDATE SKIP LOCKED;'''
+
+#: Record a failed attempt to send a post, backing off exponentially
+FAILED = '''
+UPDATE post_outbox
+  SET attempts = attempts + 1,
+      next_attempt = now() + LEAST(:backoff * (2 ^ attempts), :max_backoff)
+                             * INTERVAL '1 second',
+      dead = (attempts + 1 >= :max_attempts),
+      error = :error
+  WHERE post_id = :post_id
+  RETURNING dead;'''
+
+
+class OutboxQuery(object):
+    '''The posts that are waiting to be sent.
+
+The posts are stored in the ``post_outbox`` table (see
+``sql/05-post-outbox.sql``), keyed by the post ID.'''
+
+    def __init__(self, context):
+        self.context = context
+        self.outboxTable = getTable('post_outbox')
+
+    def add(self, site_id, group_id, list_path, post_id, headers, delay=0):
+        """ Add a post to the outbox. It is not due to be retried by
+            ``due`` for ``delay`` seconds.
+
+        """
+        ot = self.outboxTable
+        i = ot.insert().values(
+            next_attempt=sa.func.now() + timedelta(seconds=delay))
+        session = getSession()
+        session.execute(i, params={'post_id': post_id,
+                                   'site_id': site_id,
+                                   'group_id': group_id,
+                                   'list_path': list_path,
+                                   'headers': compress(headers)})
+
+    def claim(self, post_id):
+        """ Lock a post in the outbox until the end of the transaction.
+
+            Returns:
+                The header block of the post, or None if the post has been
+                sent, is dead, or is being sent by another transaction.
+
+        """
+        session = getSession()
+        r = session.execute(sa.text(CLAIM), params={'post_id': post_id})
+        row = r.fetchone()
+        retval = decompress(row['headers']) if row is not None else None
+        return retval
+
+    def remove(self, post_id):
+        """ Remove a post that has been sent, returning the number
+            removed.
+
+        """
+        ot = self.outboxTable
+        d = ot.delete(ot.c.post_id == post_id)
+        session = getSession()
+        r = session.execute(d)
+        return r.rowcount
+
+    def failed(self, post_id, error, max_attempts, backoff, max_backoff):
+        """ Record a failure to send a post.
+
+            Returns:
+                True if the post has now been tried ``max_attempts`` times,
+                and is dead.
+
+        """
+        session = getSession()
+        r = session.execute(sa.text(FAILED), params={
+            'post_id': post_id, 'error': error or '',
+            'max_attempts': max_attempts, 'backoff': backoff,
+            'max_backoff': max_backoff})
+        retval = bool(r.scalar())
+        return retval
+
+    def due(self, limit=1000):
+        """ The posts that should be retried.
+
+            Returns:
+                [(list_path, post_id), ...], grouped by the list path.
+
+        """
+        ot = self.outboxTable
+        statement = sa.select([ot.c.list_path, ot.c.post_id], limit=limit,
+                              order_by=(ot.c.list_path, ot.c.date))
+        statement.append_whereclause(sa.not_(ot.c.dead))
+        statement.append_whereclause(ot.c.next_attempt <= sa.func.now())
+
+        session = getSession()
+        r = session.execute(statement)
+        retval = [(row['list_path'], row['post_id']) for row in r]
+        return retval
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+from __future__ import absolute_import, unicode_literals
+import re
+from logging import getLogger
+log = getLogger('XWFMailingListManager.patterns')
+from .lrucache import LRUCache
+
+#: Constructs that change their meaning when a pattern is combined with
+#: others: global inline-flags, and references to numbered or named groups.
+UNCOMBINABLE = re.compile(r'\(\?[aiLmsux]+\)|\\[1-9]|\(\?P=')
+
+
+class PatternMatcher(object):
+    '''A compiled list of regular expressions, such as the ``spamlist``
+property.
+
+Patterns that fail to compile are logged and skipped. If possible the
+patterns are also combined into a single alternation, so ``search`` scans
+the text once rather than once per pattern.'''
+
+    def __init__(self, patterns):
+        self.patterns = tuple([p for p in patterns if p])
+        self.compiled = []
+        for pattern in self.patterns:
+            try:
+                self.compiled.append(re.compile(pattern))
+            except re.error as e:
+                log.warning('Skipping the invalid expression "%s": %s',
+                            pattern, e)
+        self.combined = None
+        valid = [c.pattern for c in self.compiled]
+        if ((len(valid) > 1)
+                and not any([UNCOMBINABLE.search(p) for p in valid])):
+            try:
+                self.combined = re.compile(
+                    '|'.join(['(?:{0})'.format(p) for p in valid]))
+            except (re.error, AssertionError):
+                # Too many groups, normally
+                self.combined = None
+
+    def search(self, text):
+        '''Does any of the patterns match the text?'''
+        if self.combined is not None:
+            retval = self.combined.search(text) is not None
+        else:
+            retval = any(c.search(text) is not None
+                         for c in self.compiled)
+        return retval
+
+    def sub(self, repl, text):
+        '''Replace the matches of each pattern in turn.'''
+        retval = text
+        for c in self.compiled:
+            retval = c.sub(repl, retval)
+        return retval
+
+    def __len__(self):
+        return len(self.compiled)
+
+
+#: The matchers, keyed by their patterns, so a changed property gets a new
+#: matcher
+matchers = LRUCache(maxsize=256)
+
+
+def get_matcher(patterns):
+    '''Get the compiled matcher for a list of patterns.'''
+    key = tuple(patterns or ())
+    retval = matchers.get(key)
+    if retval is None:
+        retval = PatternMatcher(key)
+        matchers.set(key, retval)
+    return retval
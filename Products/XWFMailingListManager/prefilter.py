@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+from __future__ import absolute_import, unicode_literals
+from email.parser import HeaderParser
+from email.utils import parseaddr
+from hashlib import md5
+from zope.cachedescriptors.property import Lazy
+from .MailBoxerTools import split_offsets
+
+#: The most of a message that is treated as the header block by the
+#: pre-filter, so a message with no blank line is never copied out of its
+#: memory-map in full
+MAX_HEADER_BLOCK = 256 * 1024
+#: The headers that identify a message. They are the same each time the
+#: message is delivered, unlike headers such as ``Received``.
+CHECKSUM_HEADERS = ('Message-ID', 'From', 'Date', 'Subject')
+
+
+def header_block(mailString, limit=MAX_HEADER_BLOCK):
+    '''Get the header block of a message, without the body.
+
+The message can be a string or a read-only buffer, such as a memory-map;
+only the header block, up to ``limit`` bytes of it, is copied out of it.'''
+    end, start = split_offsets(mailString, limit)
+    retval = mailString[:end]
+    return retval
+
+
+class MailHeaders(object):
+    '''The headers of a message, as it was received.
+
+Only the header block is looked at, so the headers can be checked
+cheaply before the (possibly large) message is parsed.'''
+
+    def __init__(self, mailString):
+        self.block = header_block(mailString)
+
+    @Lazy
+    def headers(self):
+        retval = HeaderParser().parsestr(self.block, headersonly=True)
+        return retval
+
+    def get(self, name, default=None):
+        retval = self.headers.get(name, default)
+        return retval
+
+    @Lazy
+    def sender(self):
+        'The lower-case address in the From header'
+        retval = parseaddr(self.get('From', ''))[1].lower()
+        return retval
+
+    @Lazy
+    def checksum(self):
+        '''A checksum of the headers that identify the message (see
+``CHECKSUM_HEADERS``), so a message has the same checksum each time the MTA
+delivers it.'''
+        values = []
+        for name in CHECKSUM_HEADERS:
+            value = self.get(name, b'').strip()
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            values.append(value)
+        retval = md5(b'\n'.join(values)).hexdigest()
+        return retval
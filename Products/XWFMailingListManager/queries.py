@@ -4,10 +4,15 @@ import sqlalchemy as sa
 from gs.core import to_unicode_or_bust as to_unicode
 from gs.database import getTable, getSession
 from querymember import MemberQuery  # lint:ok
+from groupcounters import GroupCountersQuery
+
+
+#: The length of the summary of a post
+SUMMARY_LENGTH = 160
 
 
 def summary(s):
-    retval = to_unicode(s)[:160]
+    retval = to_unicode(s)[:SUMMARY_LENGTH]
     return retval
 
 
@@ -25,6 +30,11 @@ class MessageQuery(object):
         except NoSuchTableError:
             self.post_id_mapTable = None
 
+        try:
+            self.groupCounters = GroupCountersQuery(context)
+        except NoSuchTableError:
+            self.groupCounters = None
+
     def __add_std_where_clauses(self, statement, table,
                                        site_id, group_ids=None):
         '''Add the standard "where" clauses to an SQL statement
@@ -51,6 +61,40 @@ class MessageQuery(object):
             statement.append_whereclause(inStatement)
         return statement
 
+    def __add_keyset_clause(self, statement, dateCol, idCol, before):
+        '''Add the "where" clause for a keyset (cursor) page
+
+        DESCRIPTION
+            Rather than skipping an offset, the next page of a list that
+            is ordered by date (newest first) is found by looking for
+            the rows that come before the last row of the previous page.
+            PostgreSQL can then seek straight to the page using the
+            index on the date and ID, however deep the page is.
+
+        ARGUMENTS
+            "statement":  An SQL statement.
+            "dateCol":    The column holding the date.
+            "idCol":      The column holding the ID, which breaks ties
+                          between rows with the same date.
+            "before":     The date and ID of the last row on the previous
+                          page, as a 2-tuple, or None for the first page.
+
+        RETURNS
+            The SQL statement, with the keyset restriction appended to
+            the "WHERE" clause.
+
+        SIDE EFFECTS
+            The "WHERE" clause of "statement" is changed in place, if
+            "before" is not None.
+        '''
+        if before is not None:
+            beforeDate, beforeId = before
+            keyset = (sa.tuple_(dateCol, idCol)
+                      < sa.tuple_(sa.literal(beforeDate),
+                                  sa.literal(beforeId)))
+            statement.append_whereclause(keyset)
+        return statement
+
     def marshal_topic(self, x):
         retval = {'topic_id': x['topic_id'],
                 'site_id': x['site_id'],
@@ -64,18 +108,64 @@ class MessageQuery(object):
         assert retval
         return retval
 
-    def marshall_post(self, x):
-        return {'post_id': x['post_id'],
-                'site_id': x['site_id'],
-                'group_id': x['group_id'],
-                'subject': to_unicode(x['subject']),
-                'date': x['date'],
-                'author_id': x['user_id'],
-                'hidden': x['hidden'],
-                'files_metadata': x['has_attachments']
-                          and self.files_metadata(x['post_id']) or [],
-                'body': to_unicode(x['body']),
-                'summary': summary(x['body'])}
+    def post_select(self, listing=False, **kwargs):
+        """ Create a select statement for the post table.
+
+            In listing mode the body is left out, and only the summary
+            is selected (using "left(body, 160)"), so the body is never
+            sent from the database.
+
+        """
+        pt = self.postTable
+        if listing:
+            cols = [c for c in pt.c if c.name != 'body']
+            cols.append(sa.func.left(pt.c.body,
+                                     SUMMARY_LENGTH).label('summary'))
+            retval = sa.select(cols, **kwargs)
+        else:
+            retval = pt.select(**kwargs)
+        return retval
+
+    def marshall_post(self, x, files=None, listing=False):
+        """ Marshall a row from the post table.
+
+            The metadata for the files is taken from ``files``, as
+            returned by ``files_metadata_for``, if it is given; otherwise
+            it is retrieved for the post. In listing mode the row is from
+            a "post_select(listing=True)" statement, and the post lacks
+            a body.
+
+        """
+        if files is None:
+            filesMetadata = (x['has_attachments']
+                             and self.files_metadata(x['post_id']) or [])
+        else:
+            filesMetadata = files.get(x['post_id'], [])
+        retval = {'post_id': x['post_id'],
+                  'site_id': x['site_id'],
+                  'group_id': x['group_id'],
+                  'subject': to_unicode(x['subject']),
+                  'date': x['date'],
+                  'author_id': x['user_id'],
+                  'hidden': x['hidden'],
+                  'files_metadata': filesMetadata}
+        if listing:
+            retval['summary'] = to_unicode(x['summary'])
+        else:
+            retval['body'] = to_unicode(x['body'])
+            retval['summary'] = summary(x['body'])
+        return retval
+
+    def marshall_posts(self, rows, listing=False):
+        """ Marshall many rows from the post table, retrieving the
+            metadata for the files of all the posts in one query.
+
+        """
+        rows = list(rows)
+        postIds = [x['post_id'] for x in rows if x['has_attachments']]
+        files = self.files_metadata_for(postIds)
+        retval = [self.marshall_post(x, files, listing) for x in rows]
+        return retval
 
     def post_id_from_legacy_id(self, legacy_post_id):
         """ Given a legacy (pre-1.0) GS post_id, determine what the new
@@ -121,23 +211,46 @@ class MessageQuery(object):
 
         return topic_id
 
-    def latest_posts(self, site_id, group_ids=None, limit=None, offset=0):
+    def latest_posts(self, site_id, group_ids=None, limit=None, offset=0,
+                     before=None, listing=False):
+        """ Retrieve the latest posts, newest first.
+
+            Pages can be retrieved using the "limit" and "offset", or by
+            passing the "date" and "post_id" of the last post of the
+            previous page as "before". The latter uses an index seek, so
+            deep pages are as quick as the first.
+
+            In "listing" mode the posts have a summary but no body.
+
+        """
         if group_ids is None:
             group_ids = []
-        statement = self.postTable.select(limit=limit, offset=offset,
-                                 order_by=sa.desc(self.postTable.c.date))
+        pt = self.postTable
+        statement = self.post_select(listing, limit=limit, offset=offset,
+                                     order_by=(sa.desc(pt.c.date),
+                                               sa.desc(pt.c.post_id)))
         self.__add_std_where_clauses(statement, self.postTable,
                                      site_id, group_ids)
+        self.__add_keyset_clause(statement, pt.c.date, pt.c.post_id, before)
         session = getSession()
         r = session.execute(statement)
 
         retval = []
         if r.rowcount:
-            retval = [self.marshall_post(x) for x in r]
+            retval = self.marshall_posts(r, listing)
+
+        return retval
 
+    def counters_readable(self, site_id):
+        '''Can the counts be read from the group counters, rather than
+        added up from the topic table?'''
+        retval = ((self.groupCounters is not None)
+                  and self.groupCounters.is_reconciled(site_id))
         return retval
 
     def post_count(self, site_id, group_ids=None):
+        if self.counters_readable(site_id):
+            return self.groupCounters.counts(site_id, group_ids)[0]
         if group_ids is None:
             group_ids = []
         statement = sa.select([sa.func.sum(self.topicTable.c.num_posts)])
@@ -153,6 +266,8 @@ class MessageQuery(object):
         return retval
 
     def topic_count(self, site_id, group_ids=None):
+        if self.counters_readable(site_id):
+            return self.groupCounters.counts(site_id, group_ids)[1]
         if group_ids is None:
             group_ids = []
         statement = sa.select([sa.func.count(self.topicTable.c.topic_id)])
@@ -165,8 +280,14 @@ class MessageQuery(object):
         assert retval >= 0
         return retval
 
-    def latest_topics(self, site_id, group_ids=None, limit=None, offset=0):
-        """
+    def latest_topics(self, site_id, group_ids=None, limit=None, offset=0,
+                      before=None):
+        """ Retrieve the topics with the latest posts, newest first.
+
+            Pages can be retrieved using the "limit" and "offset", or by
+            passing the "last_post_date" and "topic_id" of the last topic
+            of the previous page as "before".
+
             Returns:
              ({'topic_id': ID, 'subject': String, 'first_post_id': ID,
                'last_post_id': ID, 'count': Int, 'last_post_date': Date,
@@ -175,9 +296,12 @@ class MessageQuery(object):
             group_ids = []
         tt = self.topicTable
         statement = tt.select(limit=limit, offset=offset,
-                              order_by=sa.desc(tt.c.last_post_date))
+                              order_by=(sa.desc(tt.c.last_post_date),
+                                        sa.desc(tt.c.topic_id)))
         self.__add_std_where_clauses(statement, self.topicTable,
                                      site_id, group_ids)
+        self.__add_keyset_clause(statement, tt.c.last_post_date,
+                                 tt.c.topic_id, before)
 
         session = getSession()
         r = session.execute(statement)
@@ -296,6 +420,34 @@ class MessageQuery(object):
         """
         return self._nav_topic(curr_topic_id, 'next')
 
+    def _topic_navigation(self, where, params):
+        # The lag and lead window-functions find the previous and next post
+        # of every post in the topic in one pass, and the first and last
+        # post come from the topic itself, so the navigation is retrieved
+        # in one query.
+        s = sa.text("""select nav.post_id, nav.previous_post_id,
+                              nav.next_post_id, topic.first_post_id,
+                              topic.last_post_id
+                    from (select post_id, topic_id,
+                                 lag(post_id) over w as previous_post_id,
+                                 lead(post_id) over w as next_post_id
+                          from post
+                          where %s
+                          window w as (order by date, post_id)) as nav
+                    join topic on topic.topic_id = nav.topic_id
+                    %s""" % where)
+
+        session = getSession()
+        r = session.execute(s, params=params)
+        retval = {}
+        for row in r:
+            retval[row['post_id']] = {
+                'first_post_id': row['first_post_id'],
+                'next_post_id': row['next_post_id'],
+                'previous_post_id': row['previous_post_id'],
+                'last_post_id': row['last_post_id']}
+        return retval
+
     def topic_post_navigation(self, curr_post_id):
         """ Retrieve first/last, next/prev navigation relative to a post,
             within a topic.  Used for navigation of single posts *within* a
@@ -308,49 +460,37 @@ class MessageQuery(object):
             ID may be None.
 
         """
-        first_post_id = None
-        last_post_id = None
-        next_post_id = None
-        previous_post_id = None
+        where = ("""topic_id = (select topic_id from post
+                               where post_id = :curr_post_id)""",
+                 'where nav.post_id = :curr_post_id')
+        nav = self._topic_navigation(where, {'curr_post_id': curr_post_id})
+        retval = nav.get(curr_post_id, {'first_post_id': None,
+                                        'next_post_id': None,
+                                        'previous_post_id': None,
+                                        'last_post_id': None})
+        return retval
 
-        tt = self.topicTable
+    def topic_navigation(self, topic_id):
+        """ Retrieve the first/last, next/prev navigation for every post
+            in a topic, in one query.
 
-        topic_id = self.topic_id_from_post_id(curr_post_id)
+            Returns:
+                {post_id: {'first_post_id': ID, 'last_post_id': ID,
+                           'previous_post_id': ID, 'next_post_id': ID},
+                 ...}
 
-        if topic_id:
-            statement = tt.select()
-
-            statement.append_whereclause(tt.c.topic_id == topic_id)
-
-            session = getSession()
-            r = session.execute(statement)
-
-            if r.rowcount:
-                result = r.fetchone()
-
-                first_post_id = result['first_post_id']
-                last_post_id = result['last_post_id']
-
-            r = self._nav_post(curr_post_id, 'next', topic_id)
-            if r:
-                assert r['topic_id'] == topic_id,\
-                    "Topic ID should always match"
-                next_post_id = r['post_id']
-
-            r = self._nav_post(curr_post_id, 'prev', topic_id)
-            if r:
-                assert r['topic_id'] == topic_id,\
-                    "Topic ID should always match"
-                previous_post_id = r['post_id']
-        retval = {'first_post_id': first_post_id,
-                  'next_post_id': next_post_id,
-                  'previous_post_id': previous_post_id,
-                  'last_post_id': last_post_id}
+            ID may be None.
+
+        """
+        where = ('topic_id = :topic_id', '')
+        retval = self._topic_navigation(where, {'topic_id': topic_id})
         return retval
 
-    def topic_posts(self, topic_id):
+    def topic_posts(self, topic_id, listing=False):
         """ Retrieve all the posts in a topic.
 
+            In "listing" mode the posts have a summary but no body.
+
             Returns:
                 ({'post_id': ID, 'subject': String,
                   'date': Date, 'author_id': ID,
@@ -361,19 +501,56 @@ class MessageQuery(object):
 
         """
         pt = self.postTable
-        statement = pt.select(order_by=sa.asc(pt.c.date))
+        statement = self.post_select(listing, order_by=sa.asc(pt.c.date))
         statement.append_whereclause(pt.c.topic_id == topic_id)
 
         session = getSession()
         r = session.execute(statement)
         retval = []
         if r.rowcount:
-            retval = [self.marshall_post(x) for x in r]
+            retval = self.marshall_posts(r, listing)
         return retval
 
-    def post(self, post_id):
+    def iter_topic_posts(self, topic_id, batch_size=100, listing=False):
+        """ Iterate through all the posts in a topic.
+
+            The posts are read from a server-side cursor, in batches of
+            "batch_size", and are only marshalled when they are reached,
+            so only one batch is held in memory at a time however long
+            the topic is. The metadata for the files is retrieved for
+            each batch in one query. In "listing" mode the posts have a
+            summary but no body.
+
+            Returns:
+                A generator of
+                {'post_id': ID, 'subject': String,
+                 'date': Date, 'author_id': ID,
+                 'files_metadata': [Metadata],
+                 'body': Text}
+
+        """
+        pt = self.postTable
+        statement = self.post_select(listing, order_by=sa.asc(pt.c.date))
+        statement.append_whereclause(pt.c.topic_id == topic_id)
+        statement = statement.execution_options(stream_results=True)
+
+        session = getSession()
+        r = session.execute(statement)
+        try:
+            while True:
+                rows = r.fetchmany(batch_size)
+                if not rows:
+                    break
+                for post in self.marshall_posts(rows, listing):
+                    yield post
+        finally:
+            r.close()
+
+    def post(self, post_id, listing=False):
         """ Retrieve a particular post.
 
+            In "listing" mode the post has a summary but no body.
+
             Returns:
                 {'post_id': ID, 'group_id': ID, 'site_id': ID,
                  'subject': String,
@@ -386,7 +563,7 @@ class MessageQuery(object):
 
         """
         pt = self.postTable
-        statement = pt.select()
+        statement = self.post_select(listing)
         statement.append_whereclause(pt.c.post_id == post_id)
 
         session = getSession()
@@ -395,10 +572,45 @@ class MessageQuery(object):
             assert r.rowcount == 1, "Posts should always be unique"
             row = r.fetchone()
 
-            return self.marshall_post(row)
+            return self.marshall_post(row, listing=listing)
 
         return None
 
+    def post_exists(self, post_id):
+        """ Determine if a post has been stored, without retrieving it.
+
+            Returns:
+                True or False
+
+        """
+        pt = self.postTable
+        s = sa.select([pt.c.post_id], limit=1)
+        s.append_whereclause(pt.c.post_id == post_id)
+        statement = sa.select([sa.exists(s)])
+
+        session = getSession()
+        r = session.execute(statement)
+        retval = bool(r.scalar())
+        return retval
+
+    def posts_exist(self, post_ids):
+        """ Determine which of the posts have been stored.
+
+            Returns:
+                The set of the IDs of the posts that have been stored.
+
+        """
+        if not post_ids:
+            return set()
+        pt = self.postTable
+        statement = sa.select([pt.c.post_id])
+        statement.append_whereclause(pt.c.post_id.in_(post_ids))
+
+        session = getSession()
+        r = session.execute(statement)
+        retval = set([row['post_id'] for row in r])
+        return retval
+
     @property
     def topicCols(self):
         tt = self.topicTable
@@ -442,21 +654,36 @@ class MessageQuery(object):
                 []
 
         """
+        out = self.files_metadata_for([post_id]).get(post_id, [])
+        return out
+
+    def files_metadata_for(self, post_ids):
+        """ Retrieve the metadata of all files associated with many posts,
+            in one query.
+
+            Returns:
+                {post_id: [{'file_id': ID, 'mime_type': String,
+                            'file_name': String, 'file_size': Int}, ...],
+                 ...}
+             Posts without files are left out.
+
+        """
+        if not post_ids:
+            return {}
         ft = self.fileTable
         statement = ft.select()
-        statement.append_whereclause(ft.c.post_id == post_id)
+        statement.append_whereclause(ft.c.post_id.in_(post_ids))
 
         session = getSession()
         r = session.execute(statement)
-        out = []
-        if r.rowcount:
-            out = []
-            for row in r:
-                out.append({'file_id': row['file_id'],
-                            'file_name': to_unicode(row['file_name']),
-                            'date': row['date'],
-                            'mime_type': to_unicode(row['mime_type']),
-                            'file_size': row['file_size']})
+        out = {}
+        for row in r:
+            out.setdefault(row['post_id'], []).append({
+                'file_id': row['file_id'],
+                'file_name': to_unicode(row['file_name']),
+                'date': row['date'],
+                'mime_type': to_unicode(row['mime_type']),
+                'file_size': row['file_size']})
 
         return out
 
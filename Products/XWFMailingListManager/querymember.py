@@ -6,11 +6,6 @@ log = logging.getLogger("XMLMailingListManager.querymember")
 
 
 class MemberQuery(object):
-    # how many user ID's should we attempt to pass to the database before
-    # we just do the filtering ourselves to avoid the overhead on the
-    # database
-    USER_FILTER_LIMIT = 200
-
     def __init__(self, context):
         self.context = context
 
@@ -54,86 +49,93 @@ class MemberQuery(object):
 
         return email_addresses
 
+    # The verified-address check for a group-specific address
+    VERIFIED_GROUP_EMAIL = """
+          AND EXISTS (SELECT 1 FROM user_email AS verified
+                      WHERE verified.email = guet.email
+                        AND verified.verified_date IS NOT NULL)"""
+
+    # The group-specific addresses, which are used instead of the preferred
+    # addresses, for people who have no email settings for the group
+    GROUP_ADDRESSES = """
+        SELECT lower(guet.email) AS email
+          FROM group_user_email AS guet
+          WHERE guet.site_id = :site_id
+            AND guet.group_id = :group_id
+            AND guet.user_id = ANY(:user_ids)
+            AND NOT EXISTS (SELECT 1 FROM email_setting AS est
+                            WHERE est.group_id = :group_id
+                              AND est.user_id = guet.user_id){verified}
+        UNION ALL"""
+
+    # Skip the people with email settings, or group-specific addresses
+    SETTINGS_FILTER = """
+          AND NOT EXISTS (SELECT 1 FROM email_setting AS est
+                          WHERE est.group_id = :group_id
+                            AND est.user_id = uet.user_id)
+          AND NOT EXISTS (SELECT 1 FROM group_user_email AS guet
+                          WHERE guet.site_id = :site_id
+                            AND guet.group_id = :group_id
+                            AND guet.user_id = uet.user_id{verified})"""
+
+    MEMBER_ADDRESSES = """
+      SELECT DISTINCT addresses.email FROM ({groupAddresses}
+        SELECT lower(uet.email) AS email
+          FROM user_email AS uet
+          WHERE uet.user_id = ANY(:user_ids){preferred}{verified}{settings}
+      ) AS addresses
+      WHERE NOT EXISTS (SELECT 1 FROM email_blacklist AS eb
+                        WHERE btrim(eb.email) = addresses.email)"""
+
+    def member_addresses_statement(self, preferred_only, process_settings,
+                                   verified_only):
+        verifiedGroup = self.VERIFIED_GROUP_EMAIL if verified_only else ''
+        if process_settings:
+            groupAddresses = self.GROUP_ADDRESSES.format(
+                verified=verifiedGroup)
+            settings = self.SETTINGS_FILTER.format(verified=verifiedGroup)
+        else:
+            groupAddresses = settings = ''
+        preferred = '\n          AND uet.is_preferred' \
+            if preferred_only else ''
+        verified = '\n          AND uet.verified_date IS NOT NULL' \
+            if verified_only else ''
+        s = self.MEMBER_ADDRESSES.format(
+            groupAddresses=groupAddresses, preferred=preferred,
+            verified=verified, settings=settings)
+        retval = sa.text(s)
+        return retval
+
     def get_member_addresses(self, site_id, group_id, id_getter,
                              preferred_only=True, process_settings=True,
                              verified_only=True):
+        '''Get the addresses that should receive email from a group
+
+The addresses are resolved by a single statement, which is passed the
+member IDs as an array. The group-specific addresses are used, if the
+settings are processed, and the preferred addresses otherwise. The
+addresses are lower-case, unique, and have had the blacklist removed.'''
         # TODO: We currently can't use site_id
         site_id = ''
 
-        user_ids = id_getter(ids_only=True)
-        est = self.emailSettingTable
-        uet = self.userEmailTable
-        guet = self.groupUserEmailTable
-        session = getSession()
-        ignore_ids = []
-        email_addresses = []
-
-        # process anything that might include/exclude specific email
-        # addresses or block email delivery
-        if process_settings:
-            email_settings = est.select()
-            # FIXME: See get_digest_addresses for why
-            # email_settings.append_whereclause(est.c.site_id == site_id)
-            email_settings.append_whereclause(est.c.group_id == group_id)
-
-            r = session.execute(email_settings)
-
-            if r.rowcount:
-                for row in r:
-                    ignore_ids.append(row['user_id'])
-
-            cols = [guet.c.user_id, guet.c.email]
-            email_group = sa.select(cols)
-
-            email_group.append_whereclause(guet.c.site_id == site_id)
-            email_group.append_whereclause(guet.c.group_id == group_id)
-            if verified_only:
-                email_group.append_whereclause(guet.c.email == uet.c.email)
-                email_group.append_whereclause(uet.c.verified_date != None)
-
-            r = session.execute(email_group)
-            if r.rowcount:
-                n_ignore_ids = []
-                for row in r:
-                    # double check for security that this user should
-                    # actually be receiving email for this group
-                    if ((row['user_id'] in user_ids)
-                            and (row['user_id'] not in ignore_ids)):
-                        n_ignore_ids.append(row['user_id'])
-                        email_addresses.append(row['email'].lower())
-
-                ignore_ids += n_ignore_ids
-
-            # remove any ids we have already processed
-            user_ids = filter(lambda x: x not in ignore_ids, user_ids)
-
-        email_user = uet.select()
-        if preferred_only:
-            email_user.append_whereclause(uet.c.is_preferred == True)
-        if verified_only:
-            email_user.append_whereclause(uet.c.verified_date != None)
-
-        if len(user_ids) <= self.USER_FILTER_LIMIT:
-            email_user.append_whereclause(uet.c.user_id.in_(user_ids))
-
-        r = session.execute(email_user)
-        if r.rowcount:
-            for row in r:
-                if len(user_ids) > self.USER_FILTER_LIMIT:
-                    if row['user_id'] in user_ids:
-                        email_addresses.append(row['email'].lower())
-                else:
-                    email_addresses.append(row['email'].lower())
-
-        email_addresses = self.process_blacklist(email_addresses)
+        user_ids = list(set(id_getter(ids_only=True)))
+        if not user_ids:
+            return []
 
+        s = self.member_addresses_statement(preferred_only,
+                                            process_settings, verified_only)
+        session = getSession()
+        r = session.execute(s, params={'site_id': site_id,
+                                       'group_id': group_id,
+                                       'user_ids': user_ids})
+        email_addresses = [row['email'] for row in r]
         return email_addresses
 
     def get_digest_addresses(self, site_id, group_id, id_getter):
         # TODO: We currently can't use site_id
         site_id = ''
 
-        user_ids = id_getter(ids_only=True)
+        user_ids = set(id_getter(ids_only=True))
         est = self.emailSettingTable
         uet = self.userEmailTable
         guet = self.groupUserEmailTable
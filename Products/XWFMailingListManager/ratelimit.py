@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+from __future__ import absolute_import, unicode_literals
+from collections import deque, OrderedDict
+from threading import Lock
+from time import time
+
+
+class SenderLimiter(object):
+    '''A sliding-window limit on the number of messages from each sender.
+
+:param int maxkeys: The maximum number of senders that are tracked.
+:param int sweepInterval: How often, in seconds, every window is checked to
+                          see if it has expired.
+
+Each key (normally a list and a sender) has a window holding the times of
+the messages that were allowed in the last ``interval`` seconds, so a window
+never holds more than ``limit`` times. The windows are kept in the order of
+their last allowed message. Windows that have expired are dropped, and the
+windows with the oldest messages are dropped if there are more than
+``maxkeys``, so the memory that is used is bounded.'''
+
+    def __init__(self, maxkeys=10000, sweepInterval=60):
+        self.maxkeys = maxkeys
+        self.sweepInterval = sweepInterval
+        self._windows = OrderedDict()  # key -> (interval, times)
+        self._nextSweep = 0
+        self._lock = Lock()
+        self.accepted = 0
+        self.rejected = 0
+
+    def allow(self, key, limit, interval, now=None):
+        '''Record a message, if it is allowed.
+
+:param key: The key for the sender.
+:param int limit: The number of messages allowed in the interval. The
+                  limit is turned off if it is zero (or less).
+:param int interval: The length of the window, in seconds.
+:param now: The time of the message; defaults to the current time.
+:returns: ``True`` if the message is allowed, ``False`` otherwise.'''
+        if now is None:
+            now = time()
+        with self._lock:
+            if (limit <= 0) or (interval <= 0):
+                self.accepted += 1
+                return True
+            i, times = self._windows.get(key, (interval, deque()))
+            cutoff = now - interval
+            while times and (times[0] <= cutoff):
+                times.popleft()
+            retval = len(times) < limit
+            if retval:
+                times.append(now)
+                self.accepted += 1
+                # Move the window to the end, as it has the newest message
+                self._windows.pop(key, None)
+                self._windows[key] = (interval, times)
+            else:
+                # A rejected message is not recorded, so the window stays
+                # where it is (it is full, so it is in the dictionary)
+                self.rejected += 1
+                self._windows[key] = (interval, times)
+            self.expire(now)
+        return retval
+
+    def expire(self, now):
+        '''Drop the windows that have expired, and the oldest windows if
+there are more than ``maxkeys``. The lock must be held.'''
+        # The windows are in the order of their last message, so the
+        # oldest windows are at the start.
+        while self._windows:
+            key = next(iter(self._windows))
+            interval, times = self._windows[key]
+            if ((len(self._windows) <= self.maxkeys)
+                    and (times[-1] > (now - interval))):
+                break
+            del self._windows[key]
+        # Each window has its own interval, so a window that has expired
+        # can be behind one that has not. Every window is checked now and
+        # then to catch them.
+        if now >= self._nextSweep:
+            expired = [k for k, (interval, times) in self._windows.items()
+                       if times[-1] <= (now - interval)]
+            for key in expired:
+                del self._windows[key]
+            self._nextSweep = now + self.sweepInterval
+
+    def stats(self):
+        with self._lock:
+            retval = {'accepted': self.accepted,
+                      'rejected': self.rejected,
+                      'senders': len(self._windows)}
+        return retval
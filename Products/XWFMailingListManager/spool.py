@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+'''The inbound spool
+
+When the ``spooldir`` property of the mailing list manager is set
+``manage_mailboxer`` writes each message to the spool and returns at once.
+A pool of worker threads then drains the spool, running the messages
+through the usual pipeline.
+
+The spool is a directory with three subdirectories.
+
+``tmp``:  Messages that are being written.
+``new``:  Messages that are waiting to be processed.
+``dead``: Messages that could not be processed, with a ``.error`` file
+          holding the last traceback.
+
+Messages are written to ``tmp``, synced to disk, and then renamed into
+``new``, so a crash never leaves a partial message in the queue. A message
+is only removed from ``new`` after it has been processed, so a crash
+part-way through processing causes the message to be processed again;
+the duplicate-post check in ``processMail`` stops it being posted twice.
+
+The workers are started when Zope starts (see ``start_spools``), so the
+messages left in a spool when Zope stopped are processed straight away.
+
+Several ZEO clients can share a spool directory. Each client writes
+messages to the spool, but only the client that holds the ``lock`` file in
+the spool (using ``flock``) processes them. The other clients wait, and one
+of them takes over if the client holding the lock stops. The client holding
+the lock polls the spool every ``POLL_INTERVAL`` seconds for the messages
+written by the other clients. The spool must be on a file system that
+supports ``flock``.'''
+from __future__ import absolute_import, unicode_literals
+import fcntl
+from itertools import count
+import os
+from Queue import Queue
+from threading import Event, Lock, Thread
+from time import sleep, time
+from traceback import format_exc
+from uuid import uuid4
+from zlib import crc32
+from logging import getLogger
+log = getLogger('XWFMailingListManager.spool')
+from Acquisition import aq_base
+from .listcontext import list_context
+from .utils import MAIL_PARAMETER_NAME, iterChunks
+
+#: The default number of worker threads for each spool
+WORKERS = 4
+#: The number of times a message is tried before it is declared dead
+MAX_ATTEMPTS = 5
+#: The delay before the first retry, in seconds. It doubles each time.
+BACKOFF = 5
+#: The longest delay between retries, in seconds
+MAX_BACKOFF = 600
+#: How often the spool is scanned when no one has notified the workers
+POLL_INTERVAL = 30
+
+
+class Spool(object):
+    '''A crash-safe directory of inbound messages.'''
+    _counter = count()
+
+    def __init__(self, path):
+        self.path = path
+        self.lockPath = os.path.join(path, 'lock')
+        self.tmpDir = os.path.join(path, 'tmp')
+        self.newDir = os.path.join(path, 'new')
+        self.deadDir = os.path.join(path, 'dead')
+        for d in (self.tmpDir, self.newDir, self.deadDir):
+            if not os.path.isdir(d):
+                os.makedirs(d)
+
+    def new_name(self):
+        '''Generate a name for a message.
+
+The names sort in the order the messages were spooled, within a process.'''
+        retval = '{0:020d}.{1:06d}.{2}'.format(
+            int(time() * 1000000), next(self._counter) % 1000000,
+            uuid4().hex)
+        return retval
+
+    @staticmethod
+    def sync_dir(path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def enqueue(self, listPath, mailString):
+        '''Add a message to the spool.
+
+:param str listPath: The physical path to the mailing list.
+:param str mailString: The message, as it was received. A memory-mapped
+                       message is written out in chunks, so it is never
+                       copied into memory.
+:returns: The name of the message in the spool.'''
+        if not isinstance(listPath, bytes):
+            listPath = listPath.encode('utf-8')
+        name = self.new_name()
+        tmpPath = os.path.join(self.tmpDir, name)
+        with open(tmpPath, 'wb') as outFile:
+            outFile.write(listPath + b'\n')
+            for chunk in iterChunks(mailString):
+                outFile.write(chunk)
+            outFile.flush()
+            os.fsync(outFile.fileno())
+        os.rename(tmpPath, os.path.join(self.newDir, name))
+        self.sync_dir(self.newDir)
+        return name
+
+    def pending(self):
+        'The names of the messages waiting to be processed, oldest first'
+        retval = sorted(os.listdir(self.newDir))
+        return retval
+
+    def list_path(self, name):
+        'The path to the mailing list that a message was sent to'
+        with open(os.path.join(self.newDir, name), 'rb') as inFile:
+            retval = inFile.readline().rstrip(b'\n')
+        return retval
+
+    def read(self, name):
+        ''':returns: The list-path and the message as a 2-tuple.'''
+        with open(os.path.join(self.newDir, name), 'rb') as inFile:
+            listPath = inFile.readline().rstrip(b'\n')
+            mailString = inFile.read()
+        return (listPath, mailString)
+
+    def remove(self, name):
+        os.unlink(os.path.join(self.newDir, name))
+
+    def bury(self, name, error):
+        '''Move a message to the dead-letter directory.'''
+        deadPath = os.path.join(self.deadDir, name)
+        os.rename(os.path.join(self.newDir, name), deadPath)
+        with open(deadPath + '.error', 'wb') as errorFile:
+            if not isinstance(error, bytes):
+                error = error.encode('utf-8', 'replace')
+            errorFile.write(error)
+
+
+def process_spooled(listPath, mailString):
+    '''Process a spooled message in a new Zope connection and transaction.
+
+:param str listPath: The physical path to the mailing list.
+:param str mailString: The message.
+:returns: The result of the mailing list ``process_mailboxer`` method.'''
+    with list_context(listPath) as mailingList:
+        request = mailingList.REQUEST
+        request.set(MAIL_PARAMETER_NAME, mailString)
+        retval = mailingList.process_mailboxer(request)
+    return retval
+
+
+class SpoolWorkers(object):
+    '''Drain a spool using a pool of worker threads.
+
+Each mailing list is handled by a single worker, so the messages to a list
+are processed in the order they were spooled. A message that fails is
+retried by its worker, with an exponential backoff, before the worker moves
+on to the next message; after ``maxAttempts`` failures the message is moved
+to the dead-letter directory.
+
+The workers only run while this process holds the lock on the spool.'''
+
+    def __init__(self, spool, processor=process_spooled,
+                 numWorkers=WORKERS, maxAttempts=MAX_ATTEMPTS,
+                 backoff=BACKOFF, maxBackoff=MAX_BACKOFF,
+                 pollInterval=POLL_INTERVAL):
+        self.spool = spool
+        self.processor = processor
+        self.maxAttempts = maxAttempts
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.pollInterval = pollInterval
+        self.queues = [Queue() for i in range(max(numWorkers, 1))]
+        self.inflight = set()
+        self.inflightLock = Lock()
+        self.wakeup = Event()
+        self.threads = []
+        self.lockFile = None
+
+    def lock(self):
+        '''Try to lock the spool, so no other process drains it.
+
+:returns: ``True`` if this process now holds the lock.'''
+        if self.lockFile is None:
+            self.lockFile = open(self.spool.lockPath, 'a')
+        try:
+            fcntl.flock(self.lockFile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            retval = False
+        else:
+            retval = True
+        return retval
+
+    def start(self):
+        t = Thread(target=self.run, name='spool-dispatcher')
+        t.daemon = True
+        t.start()
+        self.threads = [t]
+
+    def run(self):
+        '''Wait for the lock on the spool, then start the workers and
+dispatch the messages to them.'''
+        while not self.lock():
+            sleep(self.pollInterval)
+        log.info('Processing the inbound spool in "%s"', self.spool.path)
+        for i, queue in enumerate(self.queues):
+            t = Thread(target=self.work, args=(queue, ),
+                       name='spool-worker-{0}'.format(i))
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+        self.dispatch()
+
+    def notify(self):
+        'Tell the dispatcher that there is a new message in the spool'
+        self.wakeup.set()
+
+    def queue_for(self, listPath):
+        i = (crc32(listPath) & 0xffffffff) % len(self.queues)
+        return self.queues[i]
+
+    def dispatch_pending(self):
+        for name in self.spool.pending():
+            with self.inflightLock:
+                if name in self.inflight:
+                    continue
+                self.inflight.add(name)
+            try:
+                listPath = self.spool.list_path(name)
+            except (IOError, OSError):
+                # Processed by a worker since the directory was listed
+                with self.inflightLock:
+                    self.inflight.discard(name)
+                continue
+            self.queue_for(listPath).put(name)
+
+    def dispatch(self):
+        while True:
+            try:
+                self.dispatch_pending()
+            except Exception:
+                log.exception('Failed to dispatch the inbound spool in '
+                              '"%s"', self.spool.path)
+            self.wakeup.wait(self.pollInterval)
+            self.wakeup.clear()
+
+    def work(self, queue):
+        while True:
+            name = queue.get()
+            try:
+                self.process(name)
+            except Exception:
+                log.exception('Failed to process the spooled message "%s"',
+                              name)
+            finally:
+                with self.inflightLock:
+                    self.inflight.discard(name)
+
+    def process(self, name):
+        listPath, mailString = self.spool.read(name)
+        for attempt in range(1, self.maxAttempts + 1):
+            try:
+                self.processor(listPath, mailString)
+            except Exception:
+                error = format_exc()
+                log.warning('Attempt %d of %d to process the spooled message '
+                            '"%s" for %s failed:\n%s', attempt,
+                            self.maxAttempts, name, listPath, error)
+                if attempt == self.maxAttempts:
+                    log.error('Moving the spooled message "%s" for %s to the '
+                              'dead-letter directory', name, listPath)
+                    self.spool.bury(name, error)
+                    break
+                sleep(min(self.backoff * (2 ** (attempt - 1)),
+                          self.maxBackoff))
+            else:
+                self.spool.remove(name)
+                break
+
+
+_workers = {}
+_workersLock = Lock()
+
+
+def get_spool_workers(path, numWorkers=WORKERS):
+    '''Get the (running) workers for the spool in a directory.'''
+    with _workersLock:
+        retval = _workers.get(path)
+        if retval is None:
+            retval = SpoolWorkers(Spool(path), numWorkers=numWorkers)
+            retval.start()
+            _workers[path] = retval
+    return retval
+
+
+def find_spools(app):
+    '''Find the spools of the mailing list managers in the root of Zope,
+and in the folders in the root.
+
+:returns: The spool directories and the number of workers for each, as
+          2-tuples.'''
+    managers = list(app.objectValues('XWF Mailing List Manager'))
+    for folder in app.objectValues():
+        if getattr(aq_base(folder), 'isPrincipiaFolderish', False):
+            managers.extend(folder.objectValues('XWF Mailing List Manager'))
+    retval = []
+    for manager in managers:
+        path = getattr(aq_base(manager), 'spooldir', '')
+        if path:
+            numWorkers = getattr(aq_base(manager), 'spoolworkers', WORKERS)
+            retval.append((path, numWorkers))
+    return retval
+
+
+def start_spools(event):
+    '''Start the workers for every spool, when the database is opened as
+Zope starts, so the messages already in the spools are processed.'''
+    connection = event.database.open()
+    try:
+        app = connection.root().get('Application')
+        spools = find_spools(app) if app is not None else []
+    except Exception:
+        log.exception('Failed to find the inbound spools')
+        spools = []
+    finally:
+        connection.close()
+    for path, numWorkers in spools:
+        get_spool_workers(path, numWorkers)
+
+
+def spool_message(path, listPath, mailString, numWorkers=WORKERS):
+    '''Add a message to a spool, and wake up the workers.
+
+:param str path: The spool directory.
+:param str listPath: The physical path to the mailing list.
+:param str mailString: The message, as it was received.
+:returns: The name of the message in the spool.'''
+    workers = get_spool_workers(path, numWorkers)
+    retval = workers.spool.enqueue(listPath, mailString)
+    workers.notify()
+    return retval
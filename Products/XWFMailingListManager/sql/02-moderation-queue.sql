@@ -0,0 +1,19 @@
+SET CLIENT_ENCODING = 'UTF8';
+SET CHECK_FUNCTION_BODIES = FALSE;
+SET CLIENT_MIN_MESSAGES = WARNING;
+
+-- The messages that are waiting for a moderator to approve or discard
+-- them. The message is compressed with zlib.
+CREATE TABLE moderation_queue (
+    post_id   TEXT                      PRIMARY KEY,
+    site_id   TEXT                      NOT NULL,
+    group_id  TEXT                      NOT NULL,
+    date      TIMESTAMP WITH TIME ZONE  NOT NULL DEFAULT now(),
+    subject   TEXT                      NOT NULL DEFAULT '',
+    sender    TEXT                      NOT NULL DEFAULT '',
+    message   BYTEA                     NOT NULL
+);
+
+CREATE INDEX moderation_queue_group_idx
+    ON moderation_queue
+    USING BTREE (site_id, group_id, date, post_id);
@@ -0,0 +1,14 @@
+SET CLIENT_ENCODING = 'UTF8';
+SET CHECK_FUNCTION_BODIES = FALSE;
+SET CLIENT_MIN_MESSAGES = WARNING;
+
+-- The indexes that let MessageQuery.latest_posts and
+-- MessageQuery.latest_topics seek straight to a page, when the page is
+-- given as the date and ID of the last row of the previous page.
+CREATE INDEX post_group_date_id_idx
+    ON post
+    USING BTREE (site_id, group_id, date DESC, post_id DESC);
+
+CREATE INDEX topic_group_date_id_idx
+    ON topic
+    USING BTREE (site_id, group_id, last_post_date DESC, topic_id DESC);
@@ -0,0 +1,29 @@
+SET CLIENT_ENCODING = 'UTF8';
+SET CHECK_FUNCTION_BODIES = FALSE;
+SET CLIENT_MIN_MESSAGES = WARNING;
+
+-- The number of posts and topics in each group. The counters are
+-- incremented as posts are stored, and reconciled with the topic table
+-- periodically. ON CONFLICT requires PostgreSQL 9.5 or later.
+CREATE TABLE group_counters (
+    site_id     TEXT    NOT NULL,
+    group_id    TEXT    NOT NULL,
+    num_posts   BIGINT  NOT NULL DEFAULT 0,
+    num_topics  BIGINT  NOT NULL DEFAULT 0,
+    PRIMARY KEY (site_id, group_id)
+);
+
+INSERT INTO group_counters (site_id, group_id, num_posts, num_topics)
+  SELECT site_id, group_id, COALESCE(SUM(num_posts), 0), COUNT(topic_id)
+    FROM topic
+    GROUP BY site_id, group_id;
+
+-- The sites whose counters have been reconciled with the topic table.
+-- Posts stored before this version of the product is running are not
+-- counted, so the counters of a site are only read once the site is in
+-- this table; until then the counts come from the topic table. Run
+-- reconcile_counters once the new version is running to add the sites.
+CREATE TABLE group_counters_reconciled (
+    site_id  TEXT                      PRIMARY KEY,
+    date     TIMESTAMP WITH TIME ZONE  NOT NULL DEFAULT now()
+);
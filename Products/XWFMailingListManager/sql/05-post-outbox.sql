@@ -0,0 +1,26 @@
+SET CLIENT_ENCODING = 'UTF8';
+SET CHECK_FUNCTION_BODIES = FALSE;
+SET CLIENT_MIN_MESSAGES = WARNING;
+
+-- The posts that have been stored but not yet sent to the members of the
+-- group. A row is added in the same transaction as the post, and deleted
+-- in the transaction that sends it. The header block of the message, as it
+-- was received, is compressed with zlib. FOR UPDATE SKIP LOCKED requires
+-- PostgreSQL 9.5 or later.
+CREATE TABLE post_outbox (
+    post_id       TEXT                      PRIMARY KEY,
+    site_id       TEXT                      NOT NULL,
+    group_id      TEXT                      NOT NULL,
+    list_path     TEXT                      NOT NULL,
+    headers       BYTEA                     NOT NULL,
+    date          TIMESTAMP WITH TIME ZONE  NOT NULL DEFAULT now(),
+    attempts      INTEGER                   NOT NULL DEFAULT 0,
+    next_attempt  TIMESTAMP WITH TIME ZONE  NOT NULL DEFAULT now(),
+    dead          BOOLEAN                   NOT NULL DEFAULT FALSE,
+    error         TEXT                      NOT NULL DEFAULT ''
+);
+
+CREATE INDEX post_outbox_due_idx
+    ON post_outbox
+    USING BTREE (next_attempt)
+    WHERE NOT dead;
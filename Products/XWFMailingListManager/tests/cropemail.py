@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+from __future__ import absolute_import, unicode_literals
+from random import Random
+from unittest import TestCase
+from Products.XWFMailingListManager.crop_email import (
+    cached_crop_email, cropped, crop_email, crop_lines, crop_posts)
+
+
+def legacy_crop_email(text, lines=0, max_consecutive_comment=12,
+                      max_consecutive_whitespace=3):
+    # The original, quadratic, implementation of crop_email
+    slines = text.split('\n')
+    intro = []
+    body = []
+    i = 1
+    bodystart = 0
+    consecutive_comment = 0
+    consecutive_whitespace = 0
+    for line in slines:
+        if (line[:2] == '--' or line[:2] == '==' or line[:2] == '__' or
+                line[:2] == '~~' or line[:3] == '- -'):
+            bodystart = 1
+
+        if bodystart:
+            body.append(line)
+        elif consecutive_comment >= max_consecutive_comment and i > 25:
+            body.append(line)
+            bodystart = 1
+        elif (i <= 15):
+            intro.append(line)
+        elif (len(line) > 3 and line[:4] != '>'):
+            intro.append(line)
+        elif consecutive_whitespace <= max_consecutive_whitespace:
+            intro.append(line)
+        else:
+            body.append(line)
+            bodystart = 1
+
+        if ((len(line) > 3)
+                and (line[:4] == '<' or line.lower().find('wrote:') != -1)):
+            consecutive_comment += 1
+        else:
+            consecutive_comment = 0
+
+        if len(line.strip()):
+            consecutive_whitespace = 0
+        else:
+            consecutive_whitespace += 1
+        i += 1
+
+    rintro = []
+    trim = 1
+    for line in intro[::-1]:
+        if len(intro) < 5:
+            trim = 0
+        if len(line) > 3:
+            ls = line[:4]
+        elif line.strip():
+            ls = line.strip()[0]
+        else:
+            ls = ''
+
+        if trim and (ls == '>' or ls == ''):
+            body.insert(0, line)
+        elif trim and line.find('wrote:') > 2:
+            body.insert(0, line)
+        elif trim and line.strip() and len(line.strip().split()) == 1:
+            body.insert(0, line)
+        else:
+            trim = 0
+            rintro.insert(0, line)
+
+    intro = '\n'.join(rintro)
+    body = '\n'.join(body)
+    return intro, body
+
+#: Lines that exercise each rule of crop_email
+LINES = ['I agree with Dinsdale.', 'It was nailed to the floor.', '', ' ',
+         '   ', '    ', '>', '> ', '>>', '> He was a hard man.',
+         '>> Vicious, but fair.', 'On Monday, Dinsdale wrote:',
+         'Dinsdale WROTE:', 'wrote:', 'Ethel', 'Ethel ', 'Doug', '--',
+         '-- ', '==', '__', '~~', '- -', 'Sent from my telephone', 'x',
+         'Stig O\'Tracy wrote: nothing', 'Kind to his mother.']
+
+
+def reply(rng, nQuoted, nText=3):
+    'A reply with some text, a signature, and a quoted message'
+    retval = ['Thank you for your message.'] * nText
+    retval += ['', 'Dinsdale', '', 'On Monday, Ethel the Frog wrote:']
+    retval += ['> ' + rng.choice(LINES) for n in range(nQuoted)]
+    return '\n'.join(retval)
+
+
+def thread(depth, nLines=5):
+    'A deeply nested, bottom-quoted, thread'
+    retval = []
+    for d in range(depth):
+        quote = '> ' * d
+        retval += [quote + 'On Monday, person {0} wrote:'.format(d)]
+        retval += [quote + 'Line {0} of message {1}.'.format(n, d)
+                   for n in range(nLines)]
+        retval += [quote.rstrip()]
+    return '\n'.join(retval)
+
+
+def random_message(rng, nLines):
+    'A message built from random lines'
+    retval = '\n'.join([rng.choice(LINES) for n in range(nLines)])
+    return retval
+
+
+class CropEmailTest(TestCase):
+    def assertSameAsLegacy(self, text, *args):
+        expected = legacy_crop_email(text, 0, *args)
+        r = crop_email(text, 0, *args)
+        self.assertEqual(expected, r)
+
+    def test_empty(self):
+        self.assertSameAsLegacy('')
+
+    def test_short(self):
+        self.assertSameAsLegacy('Hello\n\n> Quoted\nDinsdale')
+
+    def test_consecutive_comments(self):
+        text = '\n'.join(['Line {0} is long enough.'.format(n)
+                          for n in range(30)]
+                         + ['Person {0} Wrote: this'.format(n)
+                            for n in range(20)]
+                         + ['Ethel'] * 5)
+        self.assertSameAsLegacy(text)
+        self.assertSameAsLegacy(text, 3, 3)
+
+    def test_whitespace(self):
+        text = '\n'.join(['Line {0} is long enough.'.format(n)
+                          for n in range(20)]
+                         + ['', ' ', '', '', '', 'Dinsdale'])
+        self.assertSameAsLegacy(text)
+
+    def test_reply(self):
+        rng = Random(42)
+        for nQuoted in (0, 1, 5, 20, 100):
+            self.assertSameAsLegacy(reply(rng, nQuoted))
+
+    def test_thread(self):
+        for depth in (1, 3, 10, 30):
+            self.assertSameAsLegacy(thread(depth))
+
+    def test_random(self):
+        rng = Random(17)
+        for n in range(500):
+            text = random_message(rng, rng.randint(0, 80))
+            self.assertSameAsLegacy(text)
+            self.assertSameAsLegacy(text, 2, 1)
+
+    def test_crop_lines_iterator(self):
+        'crop_lines accepts any iterable of lines, such as a generator'
+        text = reply(Random(3), 20)
+        r = crop_lines(l for l in text.split('\n'))
+        intro = '\n'.join([l for inBody, l in r if not inBody])
+        self.assertEqual(crop_email(text)[0], intro)
+
+    def test_crop_lines_order(self):
+        'The intro lines are all produced before the body lines'
+        text = random_message(Random(5), 200)
+        parts = [inBody for inBody, l in crop_lines(text.split('\n'))]
+        self.assertEqual(sorted(parts), parts)
+
+
+class CachedCropEmailTest(TestCase):
+    def setUp(self):
+        cropped.clear()
+
+    def test_cached(self):
+        text = reply(Random(7), 30)
+        r1 = cached_crop_email(text)
+        r2 = cached_crop_email(text)
+        self.assertEqual(crop_email(text), r1)
+        self.assertIs(r1, r2)
+
+    def test_parameters(self):
+        'Different parameters are cached separately'
+        text = thread(10)
+        r = cached_crop_email(text, 0, 2, 1)
+        self.assertEqual(crop_email(text, 0, 2, 1), r)
+        self.assertEqual(crop_email(text), cached_crop_email(text))
+
+    def test_crop_posts(self):
+        rng = Random(11)
+        posts = [{'post_id': 'post{0}'.format(n), 'body': reply(rng, n)}
+                 for n in range(10)]
+        r = crop_posts(posts)
+        self.assertEqual([crop_email(p['body']) for p in posts], r)
+        self.assertEqual(10, len(cropped))
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+from __future__ import absolute_import, unicode_literals
+from unittest import TestCase
+from Products.XWFMailingListManager.lrucache import LRUCache
+
+
+class LRUCacheTest(TestCase):
+    def setUp(self):
+        self.cache = LRUCache(maxsize=2)
+
+    def test_get_missing(self):
+        r = self.cache.get('ethel', 'default')
+        self.assertEqual('default', r)
+        self.assertEqual(1, self.cache.misses)
+
+    def test_set_get(self):
+        self.cache.set('ethel', 'frog')
+        r = self.cache.get('ethel')
+        self.assertEqual('frog', r)
+        self.assertEqual(1, self.cache.hits)
+
+    def test_evict_least_recent(self):
+        self.cache.set('ethel', 'frog')
+        self.cache.set('dinsdale', 'piranha')
+        self.cache.get('ethel')
+        self.cache.set('doug', 'piranha')
+        self.assertIn('ethel', self.cache)
+        self.assertNotIn('dinsdale', self.cache)
+        self.assertEqual(2, len(self.cache))
+
+    def test_expires(self):
+        cache = LRUCache(maxage=-1)
+        cache.set('ethel', 'frog')
+        self.assertNotIn('ethel', cache)
+
+    def test_invalidate(self):
+        self.cache.set('ethel', 'frog')
+        self.cache.invalidate('ethel')
+        self.assertNotIn('ethel', self.cache)
+
+    def test_maxcost(self):
+        cache = LRUCache(maxsize=10, maxcost=10)
+        cache.set('ethel', 'frog', cost=4)
+        cache.set('dinsdale', 'piranha', cost=4)
+        cache.set('doug', 'piranha', cost=4)
+        self.assertNotIn('ethel', cache)
+        self.assertIn('doug', cache)
+        self.assertEqual(8, cache.cost)
+
+    def test_maxcost_too_large(self):
+        'An item that costs more than the maximum is not kept'
+        cache = LRUCache(maxsize=10, maxcost=10)
+        cache.set('ethel', 'frog', cost=11)
+        self.assertNotIn('ethel', cache)
+        self.assertEqual(0, cache.cost)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+from __future__ import absolute_import, unicode_literals
+import mimetools
+from StringIO import StringIO
+from unittest import TestCase
+from Products.XWFMailingListManager.MailBoxerTools import (splitMail,
+                                                           split_mail)
+
+MAIL = b'From: a@example.com\nSubject: Ethel\n\nGloves.\n'
+
+
+class SplitMailTest(TestCase):
+    def legacy_body(self, mailString):
+        # The body, as mimetools (used by the original splitMail) found it
+        msg = mimetools.Message(StringIO(mailString))
+        msg.rewindbody()
+        return msg.fp.read()
+
+    def test_split(self):
+        headers, body = splitMail(MAIL)
+        self.assertEqual('Ethel', headers['subject'])
+        self.assertEqual(b'Gloves.\n', body)
+
+    def test_crlf(self):
+        mail = MAIL.replace(b'\n', b'\r\n')
+        headers, body = splitMail(mail)
+        self.assertEqual('Ethel', headers['subject'])
+        self.assertEqual(self.legacy_body(mail), body)
+
+    def test_no_body(self):
+        headers, body = splitMail(b'From: a@example.com\nSubject: Ethel\n')
+        self.assertEqual('Ethel', headers['subject'])
+        self.assertEqual(b'', body)
+
+    def test_leading_blank_line(self):
+        'A mail that starts with a blank line has no headers'
+        mail = b'\nFrom: a@example.com\n\nGloves.\n'
+        headers, body = splitMail(mail)
+        self.assertEqual({}, headers)
+        self.assertEqual(self.legacy_body(mail), body)
+        self.assertEqual(mail[1:], body)
+
+    def test_leading_blank_line_crlf(self):
+        mail = b'\r\nFrom: a@example.com\r\n\r\nGloves.\r\n'
+        headers, body = split_mail(mail)
+        self.assertEqual([], headers.items())
+        self.assertEqual(mail[2:], body.tobytes())
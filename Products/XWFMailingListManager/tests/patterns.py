@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+from __future__ import absolute_import, unicode_literals
+from unittest import TestCase
+from Products.XWFMailingListManager.patterns import (
+    PatternMatcher, get_matcher)
+
+
+class PatternMatcherTest(TestCase):
+    def test_combined(self):
+        m = PatternMatcher(['viagra', r'lottery\s+win', ''])
+        self.assertIsNotNone(m.combined)
+        self.assertTrue(m.search('You have a lottery  winner'))
+        self.assertFalse(m.search('Ethel the Frog'))
+
+    def test_not_combined_flags(self):
+        m = PatternMatcher([r'(?s)\n-- .*', 'viagra'])
+        self.assertIsNone(m.combined)
+        self.assertTrue(m.search('Hello\n-- \nDinsdale'))
+
+    def test_not_combined_backreference(self):
+        m = PatternMatcher([r'(a)\1', 'viagra'])
+        self.assertIsNone(m.combined)
+        self.assertTrue(m.search('baab'))
+
+    def test_invalid_skipped(self):
+        m = PatternMatcher(['(unclosed', 'viagra'])
+        self.assertEqual(1, len(m))
+        self.assertTrue(m.search('viagra'))
+
+    def test_sub(self):
+        m = PatternMatcher([r'(?s)\n-- .*'])
+        r = m.sub('', 'Hello\n-- \nDinsdale')
+        self.assertEqual('Hello', r)
+
+    def test_get_matcher_cached(self):
+        m1 = get_matcher(('viagra', 'lottery'))
+        m2 = get_matcher(('viagra', 'lottery'))
+        self.assertIs(m1, m2)
+        m3 = get_matcher(('viagra', ))
+        self.assertIsNot(m1, m3)
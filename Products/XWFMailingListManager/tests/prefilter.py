@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+from __future__ import absolute_import, unicode_literals
+from unittest import TestCase
+from Products.XWFMailingListManager.prefilter import (MailHeaders,
+                                                      header_block)
+
+MAIL = b'''Received: from mx{0}.example.com
+Message-ID: <ethel@example.com>
+From: Dinsdale <dinsdale@example.com>
+Date: Mon, 14 Mar 2016 12:00:00 +0000
+Subject: {1}
+
+Gloves.
+'''
+
+
+class MailHeadersTest(TestCase):
+    def test_checksum_redelivered(self):
+        'The Received headers do not change the checksum'
+        first = MailHeaders(MAIL.format(1, 'Ethel'))
+        second = MailHeaders(MAIL.format(2, 'Ethel'))
+        self.assertEqual(first.checksum, second.checksum)
+
+    def test_checksum_different(self):
+        first = MailHeaders(MAIL.format(1, 'Ethel'))
+        second = MailHeaders(MAIL.format(1, 'Piranha'))
+        self.assertNotEqual(first.checksum, second.checksum)
+
+    def test_sender(self):
+        headers = MailHeaders(MAIL.format(1, 'Ethel'))
+        self.assertEqual('dinsdale@example.com', headers.sender)
+
+    def test_header_block(self):
+        r = header_block(MAIL.format(1, 'Ethel'))
+        self.assertTrue(r.endswith(b'Subject: Ethel'))
+
+    def test_header_block_limit(self):
+        'A message without a blank line is not copied in full'
+        r = header_block(b'X-Ethel: Piranha\n' * 100, limit=64)
+        self.assertEqual(64, len(r))
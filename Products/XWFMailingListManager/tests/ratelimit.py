@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+from __future__ import absolute_import, unicode_literals
+from unittest import TestCase
+from Products.XWFMailingListManager.ratelimit import SenderLimiter
+
+
+class SenderLimiterTest(TestCase):
+    key = ('ethel', 'dinsdale@example.com')
+
+    def setUp(self):
+        self.limiter = SenderLimiter(maxkeys=2)
+
+    def test_under_limit(self):
+        for i in range(3):
+            r = self.limiter.allow(self.key, 3, 600, now=i)
+            self.assertTrue(r)
+        self.assertEqual(3, self.limiter.accepted)
+
+    def test_over_limit(self):
+        for i in range(3):
+            self.limiter.allow(self.key, 3, 600, now=i)
+        r = self.limiter.allow(self.key, 3, 600, now=3)
+        self.assertFalse(r)
+        self.assertEqual(1, self.limiter.rejected)
+
+    def test_window_slides(self):
+        for i in range(3):
+            self.limiter.allow(self.key, 3, 600, now=i)
+        r = self.limiter.allow(self.key, 3, 600, now=600.5)
+        self.assertTrue(r)
+
+    def test_disabled(self):
+        for i in range(20):
+            r = self.limiter.allow(self.key, 0, 600, now=i)
+            self.assertTrue(r)
+
+    def test_max_keys(self):
+        for i, sender in enumerate(('a', 'b', 'c')):
+            self.limiter.allow(sender, 3, 600, now=i)
+        self.assertEqual(2, self.limiter.stats()['senders'])
+
+    def test_expired(self):
+        self.limiter.allow('a', 3, 10, now=0)
+        self.limiter.allow('b', 3, 10, now=20)
+        self.assertEqual(1, self.limiter.stats()['senders'])
+
+    def test_disabled_counted(self):
+        for i in range(5):
+            self.limiter.allow(self.key, 0, 600, now=i)
+        self.assertEqual(5, self.limiter.stats()['accepted'])
+
+    def test_rejected_not_moved(self):
+        'A rejected message does not make its window the newest'
+        self.limiter.allow('a', 1, 600, now=0)
+        self.limiter.allow('b', 1, 600, now=1)
+        self.assertFalse(self.limiter.allow('a', 1, 600, now=2))
+        self.limiter.allow('c', 1, 600, now=3)
+        # The window for "a" was the oldest, so it was dropped
+        self.assertTrue(self.limiter.allow('a', 1, 600, now=4))
+
+    def test_expired_different_intervals(self):
+        limiter = SenderLimiter(maxkeys=10, sweepInterval=60)
+        limiter.allow('a', 3, 1000, now=0)
+        limiter.allow('b', 3, 10, now=1)
+        limiter.allow('c', 3, 1000, now=100)
+        # The window for "b" expired behind the window for "a"
+        self.assertEqual(2, limiter.stats()['senders'])
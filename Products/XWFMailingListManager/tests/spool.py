@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+from __future__ import absolute_import, unicode_literals
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import sleep, time
+from unittest import TestCase
+from Products.XWFMailingListManager.spool import Spool, SpoolWorkers
+
+MAIL = b'From: a@example.com\nSubject: Ethel\n\nGloves.\n'
+LIST_PATH = b'/groupserver/ListManager/ethel'
+
+
+class SpoolWorkersTest(TestCase):
+    def setUp(self):
+        self.path = mkdtemp()
+        self.spool = Spool(self.path)
+        self.processed = []
+
+    def tearDown(self):
+        rmtree(self.path)
+
+    def processor(self, listPath, mailString):
+        self.processed.append((listPath, mailString))
+
+    def failing_processor(self, listPath, mailString):
+        raise ValueError('Ethel')
+
+    def wait_for(self, condition, timeout=5):
+        end = time() + timeout
+        while not condition() and (time() < end):
+            sleep(0.01)
+        return condition()
+
+    def workers(self, processor):
+        retval = SpoolWorkers(self.spool, processor=processor, numWorkers=2,
+                              maxAttempts=2, backoff=0, pollInterval=0.05)
+        retval.start()
+        return retval
+
+    def test_enqueue(self):
+        name = self.spool.enqueue(LIST_PATH, MAIL)
+        self.assertEqual([name], self.spool.pending())
+        self.assertEqual((LIST_PATH, MAIL), self.spool.read(name))
+
+    def test_lock(self):
+        workers = SpoolWorkers(self.spool)
+        self.assertTrue(workers.lock())
+        other = SpoolWorkers(self.spool)
+        self.assertFalse(other.lock())
+
+    def test_process(self):
+        workers = self.workers(self.processor)
+        self.spool.enqueue(LIST_PATH, MAIL)
+        workers.notify()
+        self.assertTrue(self.wait_for(lambda: not self.spool.pending()))
+        self.assertEqual([(LIST_PATH, MAIL)], self.processed)
+
+    def test_process_waiting(self):
+        'Messages spooled before the workers started are processed'
+        self.spool.enqueue(LIST_PATH, MAIL)
+        self.workers(self.processor)
+        self.assertTrue(self.wait_for(lambda: not self.spool.pending()))
+        self.assertEqual(1, len(self.processed))
+
+    def test_bury(self):
+        self.workers(self.failing_processor)
+        name = self.spool.enqueue(LIST_PATH, MAIL)
+        deadPath = os.path.join(self.spool.deadDir, name)
+        self.assertTrue(self.wait_for(
+            lambda: os.path.exists(deadPath + '.error')))
+        self.assertEqual([], self.spool.pending())
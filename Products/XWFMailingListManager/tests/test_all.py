@@ -16,7 +16,20 @@ from __future__ import absolute_import, unicode_literals
 from unittest import TestSuite, main as unittest_main
 from Products.XWFMailingListManager.tests.XWFMailingList import (
     XWFMailingListTest)
-testCases = (XWFMailingListTest, )
+from Products.XWFMailingListManager.tests.cropemail import (
+    CropEmailTest, CachedCropEmailTest)
+from Products.XWFMailingListManager.tests.lrucache import LRUCacheTest
+from Products.XWFMailingListManager.tests.mailboxertools import (
+    SplitMailTest)
+from Products.XWFMailingListManager.tests.patterns import PatternMatcherTest
+from Products.XWFMailingListManager.tests.prefilter import MailHeadersTest
+from Products.XWFMailingListManager.tests.ratelimit import SenderLimiterTest
+from Products.XWFMailingListManager.tests.spool import SpoolWorkersTest
+from Products.XWFMailingListManager.tests.utils import MailBufferTest
+testCases = (XWFMailingListTest, LRUCacheTest, PatternMatcherTest,
+             SenderLimiterTest, MailBufferTest, CropEmailTest,
+             CachedCropEmailTest, MailHeadersTest, SplitMailTest,
+             SpoolWorkersTest)
 
 
 def load_tests(loader, tests, pattern):
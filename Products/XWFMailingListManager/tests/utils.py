@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+from __future__ import absolute_import, unicode_literals
+from mmap import mmap
+from StringIO import StringIO
+from tempfile import TemporaryFile
+from unittest import TestCase
+from Products.XWFMailingListManager.utils import (
+    closeMailBuffer, getMailBufferFromRequest, getMailFromRequest,
+    iterChunks)
+
+MAIL = b'From: a@example.com\nSubject: Ethel\n\n' + (b'x' * 4096)
+
+
+class MailBufferTest(TestCase):
+    def request_for(self, mail):
+        return {'Mail': mail}
+
+    def test_string(self):
+        r = getMailBufferFromRequest(self.request_for(MAIL))
+        self.assertIs(MAIL, r)
+
+    def test_small_file(self):
+        r = getMailBufferFromRequest(self.request_for(StringIO(MAIL)))
+        self.assertEqual(MAIL, r)
+
+    def test_large_memory_file(self):
+        'A file that is in memory is not copied to disk to be mapped'
+        r = getMailBufferFromRequest(self.request_for(StringIO(MAIL)),
+                                     threshold=1024)
+        self.assertNotIsInstance(r, mmap)
+        self.assertEqual(MAIL, r)
+
+    def test_large_disk_file(self):
+        f = TemporaryFile()
+        f.write(MAIL)
+        r = getMailBufferFromRequest(self.request_for(f), threshold=1024)
+        self.assertIsInstance(r, mmap)
+        self.assertEqual(MAIL, r[:])
+        closeMailBuffer(r)
+        # The mail can still be read as a string after the map is closed
+        self.assertEqual(MAIL, getMailFromRequest(self.request_for(f)))
+        f.close()
+
+    def test_chunks(self):
+        r = b''.join(iterChunks(MAIL, 1000))
+        self.assertEqual(MAIL, r)
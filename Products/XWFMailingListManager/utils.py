@@ -2,6 +2,7 @@ try:
     from hashlib import md5
 except:
     from md5 import md5
+from mmap import mmap, ACCESS_READ
 
 
 def pin(email, hashkey):
@@ -15,7 +16,86 @@ def pin(email, hashkey):
 MAIL_PARAMETER_NAME = "Mail"
 
 
+# uploaded messages larger than this (in bytes) are read through a
+# memory-map of the file they are in, rather than copied into memory
+LARGE_MESSAGE = 1024 * 1024
+# the size of the chunks that large messages are copied in
+CHUNK_SIZE = 64 * 1024
+
+
+def mailAsString(mail):
+    # returns the Mail (a string, a memory-map or a file) as a string
+
+    if isinstance(mail, basestring):
+        retval = str(mail)
+    elif isinstance(mail, mmap):
+        retval = mail[:]
+    elif hasattr(mail, 'read'):
+        mail.seek(0)
+        retval = mail.read()
+    else:
+        retval = str(mail)
+    return retval
+
+
 def getMailFromRequest(REQUEST):
     # returns the Mail from the REQUEST-object as string
 
-    return str(REQUEST[MAIL_PARAMETER_NAME])
+    return mailAsString(REQUEST[MAIL_PARAMETER_NAME])
+
+
+def mapFile(f):
+    # returns a read-only memory-map of a file, or an empty string for an
+    # empty file (which cannot be mapped)
+
+    f.flush()
+    f.seek(0, 2)
+    if f.tell() == 0:
+        retval = b''
+    else:
+        retval = mmap(f.fileno(), 0, access=ACCESS_READ)
+    return retval
+
+
+def getMailBufferFromRequest(REQUEST, threshold=LARGE_MESSAGE):
+    # returns the Mail from the REQUEST-object as a read-only buffer that
+    # can be sliced. Only a message that was uploaded as a file, and that
+    # Zope has written to disk, avoids being copied into memory: it is
+    # memory-mapped if it is larger than the threshold. Everything else
+    # (such as the string field that smtp2zope sends, or an upload that is
+    # held in memory) is already in memory, and is returned as a string.
+    # The caller should call closeMailBuffer when it is finished with the
+    # buffer.
+
+    mail = REQUEST[MAIL_PARAMETER_NAME]
+    if isinstance(mail, basestring) or not hasattr(mail, 'read'):
+        return mailAsString(mail)
+
+    mail.seek(0, 2)
+    size = mail.tell()
+    mail.seek(0)
+    try:
+        fileno = mail.fileno()
+    except (AttributeError, EnvironmentError, ValueError):
+        # An in-memory file, with no file-descriptor to map
+        fileno = None
+    if (size <= threshold) or (fileno is None):
+        retval = mail.read()
+    else:
+        retval = mapFile(mail)
+    return retval
+
+
+def closeMailBuffer(mailBuffer):
+    # releases the memory-map made by getMailBufferFromRequest
+
+    if isinstance(mailBuffer, mmap):
+        mailBuffer.close()
+
+
+def iterChunks(mailBuffer, size=CHUNK_SIZE):
+    # yields the Mail buffer in chunks, so it can be written out without
+    # making a copy of the whole message
+
+    for i in xrange(0, len(mailBuffer), size):
+        yield mailBuffer[i:i + size]
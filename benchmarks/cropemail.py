@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+'''Compare the original implementation of ``crop_email`` with the current
+one, on quoted replies and threads of increasing length.
+
+Run with ``python benchmarks/cropemail.py`` from the root of the
+repository. Messages can also be read from files (one message per file),
+such as an export of the posts from a group, by passing the file names as
+arguments.'''
+from __future__ import absolute_import, print_function, unicode_literals
+from codecs import open as codecs_open
+from random import Random
+import sys
+from timeit import Timer
+from Products.XWFMailingListManager.crop_email import crop_email
+from Products.XWFMailingListManager.tests.cropemail import (
+    legacy_crop_email, reply, thread)
+
+
+def corpora():
+    rng = Random(42)
+    for nQuoted in (10, 100, 1000, 10000, 100000):
+        yield ('reply {0}'.format(nQuoted), [reply(rng, nQuoted)])
+    for depth in (5, 20, 100):
+        yield ('thread {0}'.format(depth), [thread(depth)])
+
+
+def file_corpus(fileNames):
+    texts = []
+    for fileName in fileNames:
+        with codecs_open(fileName, encoding='utf-8', errors='replace') as f:
+            texts.append(f.read())
+    retval = ('{0} files'.format(len(texts)), texts)
+    return retval
+
+
+def best(func, texts, repeat=3):
+    def run():
+        for text in texts:
+            func(text)
+    timer = Timer(run)
+    number = 1
+    while min(timer.repeat(1, number)) < 0.1 and number < 1000:
+        number *= 10
+    retval = min(timer.repeat(repeat, number)) / number
+    return retval
+
+
+def main(fileNames):
+    print('{0:>14} {1:>8} {2:>12} {3:>12}'.format(
+        'Corpus', 'Lines', 'legacy', 'crop_email'))
+    corpus = list(corpora())
+    if fileNames:
+        corpus.append(file_corpus(fileNames))
+    for label, texts in corpus:
+        for text in texts:
+            assert legacy_crop_email(text) == crop_email(text)
+        nLines = sum([text.count('\n') + 1 for text in texts])
+        times = [best(f, texts) for f in (legacy_crop_email, crop_email)]
+        print('{0:>14} {1:>8} {2:>10.2f}ms {3:>10.2f}ms'.format(
+            label, nLines, *[t * 1e3 for t in times]))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
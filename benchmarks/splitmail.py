@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+############################################################################
+#
+# Copyright © 2016 OnlineGroups.net and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+############################################################################
+'''Compare the old ``mimetools`` implementation of ``splitMail`` with
+``MailBoxerTools.split_mail``, on messages from 1KB to 50MB.
+
+Run with ``python benchmarks/splitmail.py`` from the root of the
+repository.'''
+from __future__ import absolute_import, print_function, unicode_literals
+import mimetools
+import StringIO
+from timeit import Timer
+from Products.XWFMailingListManager.MailBoxerTools import (splitMail,
+                                                           split_mail)
+
+HEADERS = b'''Received: from mail.example.com (mail.example.com [192.0.2.1])
+\tby groups.example.com (Postfix) with ESMTP id 3F2A1C0
+\tfor <ethel@groups.example.com>; Mon, 23 Jan 2017 10:11:12 +1300
+From: Dinsdale Piranha <dinsdale@example.com>
+To: Ethel the Frog <ethel@groups.example.com>
+Subject: Nailed to the floor
+Date: Mon, 23 Jan 2017 10:11:12 +1300
+Message-ID: <20170123101112.12345@example.com>
+MIME-Version: 1.0
+Content-Type: text/plain; charset=utf-8
+
+'''
+LINE = b'He was a hard man. Vicious, but fair. Kind to his mother.\n'
+SIZES = (('1KB', 1024), ('64KB', 64 * 1024), ('1MB', 1024 * 1024),
+         ('10MB', 10 * 1024 * 1024), ('50MB', 50 * 1024 * 1024))
+
+
+def legacy_splitMail(mailString):
+    # The original MailBoxer implementation
+    msg = mimetools.Message(StringIO.StringIO(str(mailString)))
+    mailHeader = {}
+    for (key, value) in msg.items():
+        mailHeader[key] = value
+    msg.rewindbody()
+    mailBody = msg.fp.read()
+    return (mailHeader, mailBody)
+
+
+def message(size):
+    body = LINE * (max(size - len(HEADERS), 0) // len(LINE) + 1)
+    retval = HEADERS + body[:max(size - len(HEADERS), 0)]
+    return retval
+
+
+def best(func, mailString, repeat=5):
+    timer = Timer(lambda: func(mailString))
+    number = max(1, 1024 * 1024 // len(mailString))
+    retval = min(timer.repeat(repeat, number)) / number
+    return retval
+
+
+def main():
+    print('{0:>6} {1:>12} {2:>12} {3:>12}'.format(
+        'Size', 'mimetools', 'splitMail', 'split_mail'))
+    for label, size in SIZES:
+        mailString = message(size)
+        assert (legacy_splitMail(mailString)[1] == splitMail(mailString)[1])
+        times = [best(f, mailString)
+                 for f in (legacy_splitMail, splitMail, split_mail)]
+        print('{0:>6} {1:>10.1f}us {2:>10.1f}us {3:>10.1f}us'.format(
+            label, *[t * 1e6 for t in times]))
+
+
+if __name__ == '__main__':
+    main()
@@ -57,9 +57,11 @@ setup(name='Products.XWFMailingListManager',
           'setuptools',
           'pytz',
           'SQLAlchemy',
+          'zope.cachedescriptors',
           'zope.component',
           'zope.globalrequest',
           'zope.interface',
+          'zope.processlifetime',
           'AccessControl',
           'Zope2',
           'gs.cache[redis]',  # With Redis support